@@ -0,0 +1,134 @@
+import json
+import os
+import sqlite3
+import threading
+
+# --- ANALISI VENDITE ---
+# Totali per commerciale, mese e zona tenuti in SQLite e aggiornati solo con le
+# righe nuove della copia locale dell'archivio (dove arrivano anche i salvataggi
+# della coda dopo l'invio). Con la stessa generazione della copia si sommano le
+# righe oltre l'ultima gia' contata; se la copia e' stata ricaricata da zero
+# (generazione diversa) i totali vengono ricalcolati una volta.
+# La vista legge solo queste tabelle: nessun groupby sull'archivio ad ogni rerun.
+# Con l'archivio diviso per anno c'e' un database per anno; quelli degli anni
+# chiusi vengono ricalcolati con rebuild() quando l'anno viene indicizzato.
+
+DIMENSIONI = ("totale", "venditrice", "mese", "zona")
+
+_CAMPI = ("preventivi", "totale_annuale", "totale_biennale", "con_biennale", "con_analisi", "analisi_qty")
+
+def _price(value):
+    # Prezzo italiano ("1.234,50") come salvato nel foglio
+    try:
+        return float(str(value).strip().replace('.', '').replace(',', '.') or 0)
+    except ValueError:
+        return 0.0
+
+def _qty(value):
+    try:
+        return int(float(str(value).replace(',', '.') or 0))
+    except ValueError:
+        return 0
+
+def _fold(totals, header, rows):
+    col = {name: i for i, name in enumerate(header)}
+    def get(values, name):
+        i = col.get(name)
+        return values[i] if i is not None and i < len(values) else ""
+    for values in rows:
+        if not any(str(v).strip() for v in values): continue
+        annuale = _price(get(values, "Prezzo Tot"))
+        biennale = _price(get(values, "Prezzo Biennale"))
+        qty = _qty(get(values, "Analisi Qty"))
+        delta = (1, annuale, biennale, int(biennale > 0), int(qty > 0), qty)
+        data = str(get(values, "Data"))
+        mese = data[:7] if len(data) >= 7 and data[4] == "-" else ""
+        zone = [z.strip() for z in str(get(values, "Zone")).split(",") if z.strip()] or [""]
+        keys = [("totale", ""), ("venditrice", str(get(values, "Venditrice")).strip()), ("mese", mese)]
+        keys += [("zona", z) for z in dict.fromkeys(zone)]
+        for key in keys:
+            acc = totals.setdefault(key, [0, 0.0, 0.0, 0, 0, 0])
+            for i, v in enumerate(delta): acc[i] += v
+
+class SalesAggregates:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        folder = os.path.dirname(db_path)
+        if folder: os.makedirs(folder, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS aggregati (dimensione TEXT NOT NULL, chiave TEXT NOT NULL, "
+                         "preventivi INTEGER NOT NULL, totale_annuale REAL NOT NULL, totale_biennale REAL NOT NULL, "
+                         "con_biennale INTEGER NOT NULL, con_analisi INTEGER NOT NULL, analisi_qty INTEGER NOT NULL, "
+                         "PRIMARY KEY (dimensione, chiave))")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (chiave TEXT PRIMARY KEY, valore TEXT)")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _get_meta(self, conn, key, default=None):
+        row = conn.execute("SELECT valore FROM meta WHERE chiave = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def _set_meta(self, conn, key, value):
+        conn.execute("INSERT OR REPLACE INTO meta (chiave, valore) VALUES (?, ?)", (key, json.dumps(value)))
+
+    def counted(self):
+        # (generazione della copia locale, righe gia' sommate)
+        with self._connect() as conn:
+            return (self._get_meta(conn, "generation", None), self._get_meta(conn, "rows", 0))
+
+    def update(self, mirror):
+        # Somma le righe della copia locale non ancora contate; restituisce quante
+        with self._lock:
+            generation, rows = mirror.version()
+            counted_generation, counted = self.counted()
+            rebuild = counted_generation != generation or rows < counted
+            start = 0 if rebuild else counted
+            if rows == start and not rebuild: return 0
+            header, new_rows = mirror.records(start=start)
+            if mirror.version()[0] != generation: return 0  # ricaricata nel frattempo: al prossimo giro
+            totals = {}
+            _fold(totals, header, new_rows)
+            with self._connect() as conn:
+                if rebuild: conn.execute("DELETE FROM aggregati")
+                self._add(conn, totals)
+                self._set_meta(conn, "generation", generation)
+                self._set_meta(conn, "rows", start + len(new_rows))
+            return len(new_rows)
+
+    def rebuild(self, header, rows):
+        # Ricalcola tutto da righe gia' lette (anno chiuso); la prossima update() riparte da zero
+        with self._lock:
+            totals = {}
+            _fold(totals, header, rows)
+            with self._connect() as conn:
+                conn.execute("DELETE FROM aggregati")
+                self._add(conn, totals)
+                self._set_meta(conn, "generation", None)
+                self._set_meta(conn, "rows", 0)
+            return len(rows)
+
+    def _add(self, conn, totals):
+        conn.executemany(
+            "INSERT INTO aggregati (dimensione, chiave, preventivi, totale_annuale, totale_biennale, "
+            "con_biennale, con_analisi, analisi_qty) VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (dimensione, chiave) DO UPDATE SET "
+            + ", ".join(f"{c} = {c} + excluded.{c}" for c in _CAMPI),
+            [(dim, key, *acc) for (dim, key), acc in totals.items()])
+
+    def table(self, dimensione):
+        # Righe {chiave, preventivi, totali, adesione Analisi Bando} per una dimensione
+        if dimensione not in DIMENSIONI: raise ValueError(f"Dimensione sconosciuta: {dimensione}")
+        order = "chiave DESC" if dimensione == "mese" else "totale_annuale DESC, chiave"
+        with self._connect() as conn:
+            rows = conn.execute(f"SELECT chiave, {', '.join(_CAMPI)} FROM aggregati "
+                                f"WHERE dimensione = ? ORDER BY {order}", (dimensione,)).fetchall()
+        result = []
+        for key, *values in rows:
+            item = dict(zip(_CAMPI, values), chiave=key)
+            item["adesione_analisi"] = item["con_analisi"] / item["preventivi"] if item["preventivi"] else 0.0
+            result.append(item)
+        return result
@@ -0,0 +1,119 @@
+import hmac
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import app
+
+# --- API HTTP LOCALE ---
+# Genera preventivi senza passare da Streamlit (es. dal CRM):
+#   POST /preventivi  corpo JSON con i campi di data_form -> PDF (application/pdf)
+#                     l'ID assegnato e' nell'intestazione X-Preventivo-Id
+#   GET  /salute      -> {"ok": true}
+# Le richieste sono servite da un pool di thread di dimensione fissa; oltre
+# `max_pending` richieste in attesa si risponde 503. Se PREVENTIVI_API_TOKEN e'
+# impostata serve l'intestazione "Authorization: Bearer <token>".
+
+MAX_BODY_BYTES = 256 * 1024
+
+class QuoteRequestHandler(BaseHTTPRequestHandler):
+    server_version = "PresidiaPreventivi/1.0"
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _authorized(self):
+        token = self.server.api_token
+        if not token: return True
+        header = self.headers.get("Authorization", "")
+        return hmac.compare_digest(header, f"Bearer {token}")
+
+    def do_GET(self):
+        if self.path == "/salute": return self._send_json(200, {"ok": True})
+        self._send_json(404, {"errore": "risorsa non trovata"})
+
+    def do_POST(self):
+        if self.path != "/preventivi": return self._send_json(404, {"errore": "risorsa non trovata"})
+        if not self._authorized(): return self._send_json(401, {"errore": "token mancante o non valido"})
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            length = -1
+        if length <= 0 or length > MAX_BODY_BYTES:
+            return self._send_json(400, {"errore": f"corpo JSON mancante o oltre {MAX_BODY_BYTES} byte"})
+        try:
+            payload = json.loads(self.rfile.read(length).decode("utf-8"))
+            data = app.quote_from_payload(payload)
+        except UnicodeDecodeError:
+            return self._send_json(400, {"errore": "corpo non in UTF-8"})
+        except json.JSONDecodeError as e:
+            return self._send_json(400, {"errore": f"JSON non valido: {e}"})
+        except app.QuoteInputError as e:
+            return self._send_json(422, {"errore": "dati non validi", "dettagli": e.errori})
+        try:
+            pdf_bytes = app.generate_quote(data)
+        except app.GenerationError as e:
+            return self._send_json(500, {"errore": str(e)})
+        except Exception as e:
+            return self._send_json(500, {"errore": f"{type(e).__name__}: {e}"})
+        self.send_response(200)
+        self.send_header("Content-Type", "application/pdf")
+        self.send_header("Content-Length", str(len(pdf_bytes)))
+        self.send_header("X-Preventivo-Id", str(data['preventivo_id']))
+        self.send_header("Content-Disposition", f'attachment; filename="{app.quote_file_name(data)}"')
+        self.end_headers()
+        self.wfile.write(pdf_bytes)
+
+    def log_message(self, format, *args):
+        if self.server.verbose: super().log_message(format, *args)
+
+class QuoteServer(HTTPServer):
+    # HTTPServer con pool di thread limitato (ThreadingHTTPServer crea un thread per richiesta)
+    daemon_threads = True
+
+    def __init__(self, address, workers=4, max_pending=32, api_token=None, verbose=False):
+        super().__init__(address, QuoteRequestHandler)
+        self.api_token = api_token
+        self.verbose = verbose
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="api")
+        self._slots = threading.BoundedSemaphore(workers + max_pending)
+
+    def process_request(self, request, client_address):
+        if not self._slots.acquire(blocking=False):
+            try:
+                # legge la richiesta gia' arrivata: chiudere con dati non letti farebbe un reset della connessione
+                request.settimeout(0.2)
+                try:
+                    request.recv(MAX_BODY_BYTES)
+                except OSError:
+                    pass
+                request.sendall(b"HTTP/1.1 503 Service Unavailable\r\nContent-Type: application/json\r\n"
+                                b"Content-Length: 29\r\nRetry-After: 1\r\nConnection: close\r\n\r\n"
+                                b'{"errore": "server occupato"}')
+            finally:
+                self.shutdown_request(request)
+            return
+        self._pool.submit(self._handle, request, client_address)
+
+    def _handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def server_close(self):
+        super().server_close()
+        self._pool.shutdown(wait=True)
+
+def make_server(host="127.0.0.1", port=8765, workers=4, max_pending=32, verbose=False):
+    return QuoteServer((host, port), workers, max_pending, os.environ.get("PREVENTIVI_API_TOKEN") or None, verbose)
@@ -1,18 +1,55 @@
 import streamlit as st
-from fpdf import FPDF
-from datetime import datetime, timedelta
-import pandas as pd
+from datetime import datetime
+import math
 import os
-import gspread
-from google.oauth2.service_account import Credentials
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from id_allocator import IdAllocator, max_existing_id
+from archive_mirror import ArchiveMirror
+from search_index import SearchIndex, SEARCH_FIELDS
+from save_queue import SaveQueue, STATO_SINCRONIZZATO, STATO_ERRORE
+from bulk import read_csv_rows, render_zip
+from pdf_store import PdfStore, content_hash
+from analytics import SalesAggregates
+from sheets_gate import SheetsGate, ERRORE_QUOTA, ERRORE_SERVER, ERRORE_CONNESSIONE
+from partitions import (PartitionIndex, PartitionError, LEGACY_TITLE, partition_title, partition_year,
+                        is_partitioned, row_year, split_by_year, trim_row)
+import timing
+from timing import span
+from brand import LOGO_PATH, PREZZI_ANALISI
 
 # --- CONFIGURAZIONE ---
-COMPANY_NAME = "Presidia Group srl"
-COMPANY_ADDR = "Via Vittorio Veneto, 180/1 - AREZZO"
-COMPANY_P_IVA = "P.IVA 07141051214"
-COMPANY_WEB = "www.presidiagroup.it"
-LOGO_PATH = "logo.png"
 SHEET_NAME = "DB_Preventivi"
+# pandas, gspread, google-auth e fpdf vengono importati solo al primo utilizzo
+# (dentro le funzioni), cosi' la schermata di accesso compare subito.
+DATA_DIR = os.environ.get("PREVENTIVI_DATA_DIR", "data")
+# ID prenotati in blocco da ogni processo (1 = numerazione strettamente consecutiva)
+ID_BLOCK_SIZE = int(os.environ.get("PREVENTIVI_ID_BLOCK", "1"))
+# Intervallo minimo tra due controlli del foglio per la copia locale dell'archivio
+MIRROR_POLL_SECONDS = 30
+MIRROR_FULL_SYNC_SECONDS = 3600
+# PDF compatti (logo ricompresso, stesso aspetto); PREVENTIVI_PDF_COMPACT=0 per l'uscita classica
+PDF_COMPACT = os.environ.get("PREVENTIVI_PDF_COMPACT", "1") != "0"
+# PDF originali conservati per la ristampa (oltre il limite si eliminano i meno usati)
+PDF_STORE_MAX_BYTES = int(os.environ.get("PREVENTIVI_PDF_STORE_MB", "500")) * 1024 * 1024
+# Risultati della ricerca in archivio
+RESULTS_PAGE_SIZE = 25
+EXPORT_MIME_TYPES = {"csv": "text/csv", "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"}
+RESULTS_COLUMNS = ["ID_Preventivo", "Data", "Venditrice", "Cliente", "Prezzo Tot", "Prezzo Biennale", "Email"]
+SORT_OPTIONS = {
+    "Data (piu recenti)": ("Data", True),
+    "Data (meno recenti)": ("Data", False),
+    "ID (decrescente)": ("ID_Preventivo", True),
+    "ID (crescente)": ("ID_Preventivo", False),
+}
+# Coda di salvataggio: righe inviate al foglio a blocchi da un thread in background
+SAVE_BATCH_SIZE = 50
+SAVE_FLUSH_SECONDS = 2.0
+# Archivio diviso per anno: risultati della ricerca negli anni precedenti, righe per scrittura in migrazione
+HISTORY_RESULTS = 200
+MIGRATION_CHUNK_ROWS = 2000
 
 # --- LISTA UTENTI AUTORIZZATI ---
 USERS_LIST = [
@@ -24,13 +61,6 @@ USERS_LIST = [
     "ADMIN"
 ]
 
-# Colori del Brand
-COLOR_PRIMARY = (230, 159, 42)     
-COLOR_TEXT = (40, 40, 40)          
-COLOR_LIGHT_GRAY = (248, 248, 248) 
-COLOR_BONUS_BG = (255, 250, 225)   
-COLOR_OPTIONAL_BG = (255, 253, 245) 
-
 # --- LISTA ZONE ---
 LISTA_ZONE = [
     "Tutta Italia", "Nord Italia", "Centro Italia", "Sud Italia e Isole",
@@ -41,71 +71,593 @@ LISTA_ZONE = [
     "Estero (UE)", "Estero (Extra UE)"
 ]
 
-PREZZI_ANALISI = {0: 0.00, 1: 5.00, 5: 22.50, 10: 40.00, 15: 52.50, 20: 60.00}
+# Colonne del foglio DB_Preventivi, nell'ordine di build_sheet_row()
+SHEET_COLUMNS = [
+    "ID_Preventivo", "Data", "Venditrice", "Cliente", "Prezzo Tot", "Pagamento", "Email",
+    "Prezzo Biennale", "Zone", "Tipologia", "Esiti", "Analisi Qty", "Scadenza Rate", "Validita", "Note"
+]
 
 # --- CONNESSIONE GOOGLE SHEETS ---
-def get_google_sheet():
-    scopes = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
+# Un solo client per processo: il token OAuth viene riusato fino alla scadenza
+# (AuthorizedSession lo rinnova da sola), le connessioni HTTP restano nel pool
+# e il foglio aperto resta in cache. Si ricostruisce tutto solo dopo un errore
+# di autenticazione o di trasporto.
+SHEETS_SCOPES = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
+SHEETS_POOL_SIZE = 10
+SHEETS_TIMEOUT = (5, 30)
+# Quota Google: 60 letture al minuto per utente di servizio; il limite vale per tutte le sessioni del processo
+SHEETS_PER_MINUTE = int(os.environ.get("PREVENTIVI_SHEETS_RPM", "60"))
+SHEETS_BURST = 10
+SHEETS_MAX_ATTEMPTS = 3
+
+_resources_lock = threading.Lock()
+_resources = {}
+
+def _build_google_sheet():
+    with span("sheets.autenticazione"):
+        return _open_google_sheet()
+
+def _open_google_sheet():
+    import gspread
+    from google.oauth2.service_account import Credentials
+    from requests.adapters import HTTPAdapter
     creds_dict = dict(st.secrets["gcp_service_account"])
-    creds = Credentials.from_service_account_info(creds_dict, scopes=scopes)
+    creds = Credentials.from_service_account_info(creds_dict, scopes=SHEETS_SCOPES)
     client = gspread.authorize(creds)
+    session = client.http_client.session
+    adapter = HTTPAdapter(pool_connections=SHEETS_POOL_SIZE, pool_maxsize=SHEETS_POOL_SIZE)
+    session.mount("https://", adapter)
+    client.http_client.set_timeout(SHEETS_TIMEOUT)
     return client.open(SHEET_NAME).sheet1
 
-def get_next_preventivo_number():
+def get_google_sheet():
+    sheet = _resources.get("sheet")
+    if sheet is not None: return sheet
+    gate = get_sheets_gate()
+    with _resources_lock:
+        if "sheet" not in _resources:
+            sheet = _resources.get("sheet_factory", _build_google_sheet)()
+            # un gettone del limite per ogni richiesta HTTP del client (condiviso da file e fogli)
+            sheet.client.request = gate.metered(sheet.client.request)
+            _resources["sheet"] = sheet
+        return _resources["sheet"]
+
+def reset_google_sheet():
+    with _resources_lock:
+        _resources.pop("sheet", None)
+        _resources.pop("partition_sheets", None)  # legati al client da ricostruire
+
+def reset_resources():
+    # Dimentica client, copia locale, indici e coda (la coda viene fermata); usata da benchmark e prove
+    with _resources_lock:
+        queue = _resources.get("save_queue")
+        if queue is not None: queue.stop(5)
+        _resources.clear()
+
+def set_sheet_factory(factory):
+    # Sostituisce la connessione a Google (es. con fake_sheet.FakeWorksheet per benchmark e prove locali)
+    with _resources_lock:
+        _resources["sheet_factory"] = factory
+        _resources.pop("sheet", None)
+        _resources.pop("partition_sheets", None)
+
+def is_connection_error(e):
+    import gspread
+    import requests
+    from google.auth.exceptions import GoogleAuthError
+    if isinstance(e, (GoogleAuthError, requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    return isinstance(e, gspread.exceptions.APIError) and getattr(e, "code", None) == 401
+
+def sheets_error_kind(e):
+    if is_connection_error(e): return ERRORE_CONNESSIONE
+    code = getattr(e, "code", None)
+    if code == 429: return ERRORE_QUOTA
+    if isinstance(code, int) and 500 <= code < 600: return ERRORE_SERVER
+    return None
+
+def get_sheets_gate():
+    gate = _resources.get("sheets_gate")
+    if gate is not None: return gate
+    with _resources_lock:
+        if "sheets_gate" not in _resources:
+            _resources["sheets_gate"] = SheetsGate(sheets_error_kind, SHEETS_PER_MINUTE, SHEETS_BURST,
+                                                   max_attempts=SHEETS_MAX_ATTEMPTS)
+        return _resources["sheets_gate"]
+
+def _call_sheet(fn, anno=None):
     try:
-        sheet = get_google_sheet()
-        col_values = sheet.col_values(1)
-        if len(col_values) <= 1: return 1
-        ids = [int(val) for val in col_values[1:] if str(val).isdigit()]
-        return max(ids) + 1 if ids else 1
-    except:
-        return 1
+        return fn(get_partition_sheet(anno))
+    except Exception as e:
+        timing.count("sheets.errori")
+        if is_connection_error(e): reset_google_sheet()  # client non piu' valido: al prossimo giro si ricostruisce
+        raise
+
+def with_google_sheet(fn, retry=True, anno=None):
+    # Esegue fn(sheet) rispettando il limite di chiamate; le letture vengono ripetute dopo errori
+    # di connessione, quota (429) o server (5xx). Le scritture passano retry=False: un timeout
+    # non dice se la riga e' stata aggiunta o no, quindi si ripete solo dopo un 429.
+    # anno: foglio dell'archivio diviso (default: anno in corso, oppure sheet1 se non diviso)
+    if anno is None: anno = current_partition()
+    return get_sheets_gate().run(lambda: _call_sheet(fn, anno), retry=retry)
+
+def with_spreadsheet(fn, retry=True):
+    # Come with_google_sheet, ma fn riceve l'intero file (elenco, creazione e nomi dei fogli)
+    return get_sheets_gate().run(lambda: _call_sheet(lambda sheet: fn(sheet.spreadsheet)), retry=retry)
+
+# --- ARCHIVIO PER ANNO (partizioni) ---
+# Finche' non si esegue "cli.py partiziona" tutto resta in sheet1 come prima.
+# Dopo, ogni anno ha il suo foglio: il percorso caldo (numerazione, salvataggio,
+# copia locale, ricerca) tocca solo quello dell'anno in corso.
+_partitions_lock = threading.Lock()
+
+def get_partition_index():
+    index = _resources.get("partition_index")
+    if index is not None: return index
+    with _resources_lock:
+        if "partition_index" not in _resources:
+            _resources["partition_index"] = PartitionIndex(os.path.join(DATA_DIR, "partizioni.db"))
+        return _resources["partition_index"]
+
+def partition_years():
+    # Anni con un foglio proprio ([] = archivio non diviso). Rilevati dai nomi dei fogli una
+    # volta per processo e ricordati in partizioni.db; solleva l'errore se Google non risponde
+    years = _resources.get("partition_years")
+    if years is not None: return years
+    index = get_partition_index()
+    years = index.years()
+    if not years:
+        titles = with_spreadsheet(lambda ss: [ws.title for ws in ss.worksheets()])
+        if is_partitioned(titles):
+            years = sorted(y for y in map(partition_year, titles) if y is not None)
+            index.register(years)
+    _resources["partition_years"] = years
+    return years
+
+def current_partition():
+    # Anno del foglio in uso, None se l'archivio non e' diviso. Al primo uso dell'anno
+    # avvia in background il rollover (foglio nuovo e indice degli anni chiusi)
+    years = _resources.get("partition_years")
+    if years is None:
+        if time.time() < _resources.get("partition_retry", 0): return None
+        try:
+            years = partition_years()
+        except Exception:
+            # Google non raggiungibile e nessuna informazione locale: copia locale di sheet1
+            _resources["partition_retry"] = time.time() + MIRROR_POLL_SECONDS
+            return None
+    if not years: return None
+    anno = datetime.now().year
+    if _resources.get("partition_current") != anno:
+        _resources["partition_current"] = anno
+        schedule_rollover()
+    return anno
+
+def get_partition_sheet(anno):
+    # Foglio di un anno (None = sheet1). Quello dell'anno in corso viene creato se manca
+    sheet = get_google_sheet()
+    if anno is None: return sheet
+    found = _resources.get("partition_sheets", {}).get(anno)
+    if found is not None: return found
+    with _partitions_lock:
+        sheets = _resources.get("partition_sheets", {})
+        if anno not in sheets:
+            sheets = {y: ws for ws in sheet.spreadsheet.worksheets() if (y := partition_year(ws.title)) is not None}
+            if anno not in sheets:
+                if anno != datetime.now().year: raise PartitionError(f"Foglio {partition_title(anno)} non trovato")
+                sheets[anno] = _create_partition(sheet.spreadsheet, anno)
+            _resources["partition_sheets"] = sheets
+            if _resources.get("partition_years"):  # non durante la migrazione
+                get_partition_index().register(sheets)
+                _resources["partition_years"] = sorted(sheets)
+        return sheets[anno]
+
+def _create_partition(spreadsheet, anno):
+    title = partition_title(anno)
+    try:
+        ws = spreadsheet.add_worksheet(title, rows=1000, cols=len(SHEET_COLUMNS))
+    except Exception:
+        # creato nel frattempo da un altro processo
+        ws = next((w for w in spreadsheet.worksheets() if w.title == title), None)
+        if ws is None: raise
+        return ws
+    ws.append_row(SHEET_COLUMNS)
+    timing.count("archivio.rollover")
+    return ws
+
+def sheet_partition_of(row):
+    # Foglio di destinazione di una riga del giornale: l'anno della sua Data (None = sheet1)
+    if not partition_years(): return None
+    return row_year(row, SHEET_COLUMNS.index("Data")) or datetime.now().year
+
+def index_partition(anno, header, rows):
+    # Indice di ricerca e totali delle analisi di un anno chiuso
+    with span("archivio.indicizzazione"):
+        count = get_partition_index().replace(anno, header, rows)
+        get_sales_aggregates(anno).rebuild(header, rows)
+    return count
+
+def rollover_partitions(force=False):
+    # Lavoro di inizio anno: crea il foglio dell'anno in corso e indicizza gli anni chiusi
+    # non ancora (o non piu') indicizzati; force=True li reindicizza tutti. Restituisce gli anni letti
+    if not partition_years(): return []
+    current = datetime.now().year
+    with_google_sheet(lambda sheet: sheet.title, anno=current)  # crea il foglio se manca
+    index = get_partition_index()
+    indexed = set(index.indexed_years())
+    done = []
+    for anno in partition_years():
+        if anno >= current or (anno in indexed and not force): continue
+        values = with_google_sheet(lambda sheet: sheet.get_all_values(), anno=anno)
+        index_partition(anno, values[0] if values else SHEET_COLUMNS, values[1:])
+        done.append(anno)
+    return done
+
+def schedule_rollover():
+    # Un solo rollover alla volta per processo, fuori dal percorso della richiesta
+    with _resources_lock:
+        job = _resources.get("rollover")
+        if job is not None and not job.done(): return job
+        job = _pipeline_pool.submit(_rollover_job)
+        _resources["rollover"] = job
+        return job
+
+def _rollover_job():
+    try:
+        return rollover_partitions()
+    except Exception:
+        timing.count("archivio.rollover_falliti")  # si riprova al prossimo avvio o con "cli.py rollover"
+        return []
+
+def load_partition_row(anno, riga, preventivo_id):
+    # Riga completa di un anno chiuso (una sola lettura) come dizionario, per la ristampa
+    header = get_partition_index().header(anno) or SHEET_COLUMNS
+    values = with_google_sheet(lambda sheet: sheet.row_values(riga), anno=anno)
+    if not values or str(values[0]).strip() != str(preventivo_id):
+        get_partition_index().mark_stale(anno)
+        schedule_rollover()
+        raise PartitionError(f"il foglio {partition_title(anno)} e' cambiato, indice in aggiornamento: riprovare tra poco")
+    return dict(zip(header, values + [""] * (len(header) - len(values))))
+
+def migrate_to_partitions(dry_run=False, log=print):
+    # Sposta le righe di sheet1 nei fogli per anno (da eseguire con l'app ferma). Riprende una
+    # migrazione interrotta; sheet1 viene rinominato LEGACY_TITLE solo dopo la verifica.
+    # Restituisce {anno: righe}
+    if partition_years(): raise PartitionError("l'archivio e' gia' diviso per anno")
+    queue = get_save_queue()
+    if not queue.drain(60): raise PartitionError("ci sono ancora preventivi in coda: riprovare quando sono stati inviati")
+    values = with_google_sheet(lambda sheet: sheet.get_all_values())
+    while values and not any(str(v).strip() for v in values[-1]): values.pop()
+    header, rows = (values[0], values[1:]) if values else (SHEET_COLUMNS, [])
+    parts = split_by_year(header, rows)
+    parts.setdefault(datetime.now().year, [])
+    for anno in sorted(parts): log(f"{partition_title(anno)}: {len(parts[anno])} righe")
+    if dry_run: return {anno: len(r) for anno, r in parts.items()}
+
+    existing = with_spreadsheet(lambda ss: [ws.title for ws in ss.worksheets()])
+    for anno in sorted(parts):
+        if partition_title(anno) not in existing:
+            with_spreadsheet(lambda ss: ss.add_worksheet(partition_title(anno), rows=len(parts[anno]) + 1000,
+                                                         cols=len(header)), retry=False)
+    _resources.pop("partition_sheets", None)
+    for anno in sorted(parts):
+        expected = [trim_row(r) for r in [header] + parts[anno]]
+        # ripresa di una migrazione interrotta: il foglio deve contenere un inizio delle righe attese
+        written = [trim_row(r) for r in with_google_sheet(lambda sheet: sheet.get_all_values(), anno=anno)]
+        while written and not written[-1]: written.pop()
+        if written != expected[:len(written)]:
+            raise PartitionError(f"{partition_title(anno)} esiste gia' con righe diverse da sheet1: controllarlo a mano")
+        for start in range(len(written), len(expected), MIGRATION_CHUNK_ROWS):
+            chunk = expected[start:start + MIGRATION_CHUNK_ROWS]
+            with_google_sheet(lambda sheet: sheet.append_rows(chunk), retry=False, anno=anno)
+        # verifica: stessi ID, nello stesso ordine
+        ids = with_google_sheet(lambda sheet: sheet.col_values(1), anno=anno)
+        expected_ids = [r[0] if r else "" for r in expected]
+        while expected_ids and expected_ids[-1] == "": expected_ids.pop()
+        if ids != expected_ids: raise PartitionError(f"verifica di {partition_title(anno)} non riuscita: sheet1 non e' stato modificato")
+        log(f"{partition_title(anno)}: {len(expected) - 1} righe verificate")
+
+    get_partition_index().register(parts)
+    current = datetime.now().year
+    for anno in sorted(parts):
+        if anno < current: index_partition(anno, header, parts[anno])
+    with_google_sheet(lambda sheet: sheet.update_title(LEGACY_TITLE), retry=False)
+    log(f"sheet1 rinominato {LEGACY_TITLE} (copia di sicurezza, eliminabile dopo un controllo)")
+    with _resources_lock:
+        for key in ("partition_years", "partition_sheets", "partition_retry", "archive_df", "search_index"):
+            _resources.pop(key, None)
+    return {anno: len(r) for anno, r in parts.items()}
+
+# --- NUMERAZIONE ---
+def _seed_preventivo_number():
+    # Eseguita solo alla creazione della sequenza locale. La numerazione continua tra un anno
+    # e l'altro: con l'archivio diviso conta anche il massimo degli anni chiusi (dall'indice)
+    last = max_existing_id(with_google_sheet(lambda sheet: sheet.col_values(1)))
+    if partition_years():
+        rollover_partitions()
+        last = max(last, get_partition_index().max_id())
+    return last
+
+def get_id_allocator():
+    allocator = _resources.get("allocator")
+    if allocator is not None: return allocator
+    with _resources_lock:
+        if "allocator" not in _resources:
+            db_path = os.path.join(DATA_DIR, "numerazione.db")
+            _resources["allocator"] = IdAllocator(db_path, _seed_preventivo_number, block_size=ID_BLOCK_SIZE)
+        return _resources["allocator"]
+
+def get_next_preventivo_number():
+    # Nessun ripiego su 1: se la numerazione non e' disponibile l'errore arriva all'utente
+    with span("genera.numerazione"):
+        return get_id_allocator().next_id()
+
+# --- SALVATAGGIO (giornale locale + invio in background) ---
+def get_save_queue():
+    queue = _resources.get("save_queue")
+    if queue is not None: return queue
+    with _resources_lock:
+        if "save_queue" not in _resources:
+            queue = SaveQueue(os.path.join(DATA_DIR, "giornale.db"), _queue_on_sheet,
+                              batch_size=SAVE_BATCH_SIZE, flush_interval=SAVE_FLUSH_SECONDS,
+                              on_flushed=lambda: get_archive_mirror().invalidate(),
+                              partition_of=sheet_partition_of)
+            queue.start()  # invia anche le righe rimaste in coda da un'esecuzione precedente
+            _resources["save_queue"] = queue
+        return _resources["save_queue"]
+
+def _queue_on_sheet(fn, anno=None):
+    result = with_google_sheet(fn, retry=False, anno=anno)
+    if anno is not None and anno < datetime.now().year:
+        # riga di un anno chiuso arrivata dopo il rollover: l'indice di quell'anno va rifatto
+        get_partition_index().mark_stale(anno)
+        schedule_rollover()
+    return result
 
 # SALVATAGGIO COMPLETO DI TUTTI I CAMPI
+def build_sheet_row(data):
+    zone_str = ", ".join(data['zone'])
+    return [
+        data['preventivo_id'],
+        datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        data['user_name'],
+        data['cliente'],
+        f"{data['prezzo_1']:.2f}".replace('.', ','),
+        data['pagamento'],
+        data['email'],
+        f"{data['prezzo_2']:.2f}".replace('.', ','),
+        zone_str,
+        data['tipologia'],
+        data['esiti'],
+        data['analisibando_qty'],
+        data['scadenza_rate'],
+        data['validita'],
+        data['note']
+    ]
+
 def save_data_gsheet(data):
+    # Il preventivo e' salvato quando e' nel giornale locale; l'invio al foglio avviene in background
     try:
-        sheet = get_google_sheet()
-        zone_str = ", ".join(data['zone'])
-        
-        new_row = [
-            data['preventivo_id'],
-            datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            data['user_name'],
-            data['cliente'],
-            f"{data['prezzo_1']:.2f}".replace('.', ','),
-            data['pagamento'],
-            data['email'],
-            f"{data['prezzo_2']:.2f}".replace('.', ','),
-            zone_str,
-            data['tipologia'],
-            data['esiti'],
-            data['analisibando_qty'],
-            data['scadenza_rate'],
-            data['validita'],
-            data['note']
-        ]
-        sheet.append_row(new_row)
+        with span("genera.salvataggio"):
+            get_save_queue().enqueue(data['preventivo_id'], build_sheet_row(data))
         return True
     except Exception as e:
-        if "200" in str(e): return True
         st.error(f"Errore salvataggio DB: {e}")
         return False
 
-def load_data_from_gsheet():
+# --- VALIDAZIONE ---
+def validate_quote(data):
+    # Campi obbligatori mancanti (etichette del modulo)
+    errori = []
+    if not data['cliente']: errori.append("Ragione Sociale")
+    if not data['tipologia']: errori.append("Tipologia Gare")
+    if not data['zone']: errori.append("Zone")
+    if data['prezzo_1'] <= 0: errori.append("Prezzo Annuale")
+    if not data['pagamento']: errori.append("Modalità di Pagamento")
+    return errori
+
+# Valori iniziali del modulo, usati anche per i campi non passati all'API/CLI
+QUOTE_DEFAULTS = {
+    'email': "", 'prezzo_2': 0.0, 'zone': ["Tutta Italia"], 'esiti': "Sì", 'analisibando_qty': 0,
+    'pagamento': "Bonifico Bancario 30gg d.f.", 'scadenza_rate': "Unica Soluzione / Semestrale",
+    'validita': 15, 'note': "", 'tipologia': "", 'cliente': "", 'prezzo_1': 0.0
+}
+MAX_VALIDITA = 365  # giorni
+
+class QuoteInputError(ValueError):
+    def __init__(self, errori):
+        super().__init__("; ".join(errori))
+        self.errori = errori
+
+def quote_from_payload(payload):
+    # Dizionario JSON (stessi campi di data_form) -> dati validati per generate_quote
+    if not isinstance(payload, dict): raise QuoteInputError(["il corpo deve essere un oggetto JSON"])
+    data = dict(QUOTE_DEFAULTS)
+    data.update({k: v for k, v in payload.items() if k in QUOTE_DEFAULTS or k == 'user_name'})
+    data['preventivo_id'] = None
+    errori = []
+    user = str(data.get('user_name') or "").strip().upper()
+    if user not in USERS_LIST: errori.append(f"user_name non autorizzato: {data.get('user_name')!r}")
+    data['user_name'] = user
+    for key in ('prezzo_1', 'prezzo_2'):
+        try:
+            data[key] = float(data[key] or 0)
+        except (TypeError, ValueError):
+            errori.append(f"{key} non numerico")
+            data[key] = 0.0
+        if not math.isfinite(data[key]):
+            errori.append(f"{key} deve essere un numero finito")
+            data[key] = 0.0
+    for key in ('analisibando_qty', 'validita'):
+        # 1.9 non diventa 1: sono accettati solo valori interi (anche 30.0 o "30")
+        try:
+            value = math.nan if isinstance(data[key], bool) else float(data[key])
+        except (TypeError, ValueError, OverflowError):
+            value = math.nan
+        if not value.is_integer():
+            errori.append(f"{key} non intero")
+            value = QUOTE_DEFAULTS[key]
+        data[key] = int(value)
+    if not 1 <= data['validita'] <= MAX_VALIDITA: errori.append(f"validita deve essere tra 1 e {MAX_VALIDITA} giorni")
+    if isinstance(data['zone'], str): data['zone'] = [z.strip() for z in data['zone'].split(",") if z.strip()]
+    if not isinstance(data['zone'], list):
+        errori.append("zone deve essere una lista di zone")
+        data['zone'] = []
+    elif any(not isinstance(z, str) or z not in LISTA_ZONE for z in data['zone']):
+        errori.append(f"zone non valide: {[z for z in data['zone'] if not isinstance(z, str) or z not in LISTA_ZONE]!r}")
+    if data['analisibando_qty'] not in PREZZI_ANALISI: errori.append(f"analisibando_qty deve essere uno di {sorted(PREZZI_ANALISI)}")
+    if data['esiti'] not in ("Sì", "No"): errori.append("esiti deve essere 'Sì' o 'No'")
+    for key in ('cliente', 'email', 'tipologia', 'pagamento', 'scadenza_rate', 'note'):
+        data[key] = str(data[key] or "")
+    errori += [f"campo obbligatorio mancante: {e}" for e in validate_quote(data)]
+    if errori: raise QuoteInputError(errori)
+    return data
+
+# --- PIPELINE DI GENERAZIONE ---
+# Assegnato l'ID si genera il PDF e, solo se riesce, si scrive la riga nel giornale
+# (una transazione): un errore o l'interruzione dello script (nuovo rerun di
+# Streamlit) prima della scrittura non lascia nessun preventivo salvato a meta',
+# al massimo un numero non usato. La copia del PDF per la ristampa viene salvata
+# in background, fuori dal percorso del click.
+_pipeline_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="genera")
+
+class GenerationError(RuntimeError):
+    pass
+
+def generate_quote(data):
+    # Assegna l'ID (scritto in data['preventivo_id']), genera il PDF e salva il preventivo; restituisce i byte del PDF
+    with span("genera.totale"):
+        data['preventivo_id'] = get_next_preventivo_number()
+        try:
+            with span("genera.pdf"):
+                pdf_bytes = create_pdf(data)
+        except Exception as e:
+            raise GenerationError(f"creazione del PDF del preventivo N. {data['preventivo_id']} non riuscita: {e}") from e
+        try:
+            with span("genera.salvataggio"):
+                get_save_queue().enqueue(data['preventivo_id'], build_sheet_row(data))
+        except Exception as e:
+            raise GenerationError(f"salvataggio del preventivo N. {data['preventivo_id']} non riuscito: {e}") from e
+        _pipeline_pool.submit(store_pdf, dict(data), pdf_bytes)
+        return pdf_bytes
+
+def get_pdf_store():
+    store = _resources.get("pdf_store")
+    if store is not None: return store
+    with _resources_lock:
+        if "pdf_store" not in _resources:
+            _resources["pdf_store"] = PdfStore(os.path.join(DATA_DIR, "pdf"), PDF_STORE_MAX_BYTES)
+        return _resources["pdf_store"]
+
+def store_pdf(data, pdf_bytes):
+    # Un errore del disco non deve bloccare il preventivo: si perde solo la ristampa istantanea
     try:
-        sheet = get_google_sheet()
-        data = sheet.get_all_records()
-        if not data: return pd.DataFrame()
-        return pd.DataFrame(data)
-    except:
-        return pd.DataFrame()
+        row = dict(zip(SHEET_COLUMNS, build_sheet_row(data)))
+        get_pdf_store().put(data['preventivo_id'], data, pdf_bytes, quote_fingerprint(row))
+    except Exception:
+        timing.count("pdf_store.errori")
+
+def sync_status_label(status):
+    if status is None: return "—"
+    if status["stato"] == STATO_SINCRONIZZATO: return "✅ Sincronizzato"
+    if status["stato"] == STATO_ERRORE: return f"⚠️ Nuovo tentativo in corso ({status['tentativi']}): {status['errore']}"
+    return "⏳ In coda"
+
+# --- ARCHIVIO (copia locale) ---
+def _partition_resource(name, anno, build):
+    # Risorse legate a un foglio (copia locale, totali delle analisi): una per anno
+    key = (name, anno)
+    resource = _resources.get(key)
+    if resource is not None: return resource
+    with _resources_lock:
+        if key not in _resources: _resources[key] = build()
+        return _resources[key]
+
+def _partition_db(name, anno):
+    return os.path.join(DATA_DIR, f"{name}.db" if anno is None else f"{name}_{anno}.db")
+
+def get_archive_mirror(anno=None):
+    # Copia locale del foglio di un anno (default: quello in uso)
+    if anno is None: anno = current_partition()
+    return _partition_resource("mirror", anno, lambda: ArchiveMirror(
+        _partition_db("archivio", anno), lambda fn: with_google_sheet(fn, anno=anno),
+        MIRROR_POLL_SECONDS, MIRROR_FULL_SYNC_SECONDS))
+
+def load_data_from_gsheet(force_full=False, anno=None):
+    with span("archivio.caricamento"):
+        return _load_archive(force_full, anno)
+
+def sync_archive_mirror(force_full=False, anno=None):
+    mirror = get_archive_mirror(anno)
+    try:
+        with span("archivio.sincronizzazione"):
+            mirror.sync(force_full)
+        _resources.pop("mirror_error", None)
+    except Exception as e:
+        _resources["mirror_error"] = str(e) or type(e).__name__  # si usa l'ultima copia locale
+    return mirror
+
+def render_stale_warning(empty):
+    # Avviso se l'ultima sincronizzazione e' fallita; True se non c'e' nulla da mostrare
+    error = _resources.get("mirror_error")
+    if error is None: return False
+    last = get_archive_mirror().state()["last_sync"]
+    if empty:
+        st.error(f"⚠️ Archivio non disponibile: Google Sheets non risponde ({error}). Riprovare tra poco.")
+        return True
+    when = datetime.fromtimestamp(last).strftime("%d/%m/%Y %H:%M") if last else "sconosciuto"
+    st.warning(f"⚠️ Google Sheets non risponde ({error}): dati dell'ultimo aggiornamento riuscito ({when}).")
+    return False
+
+def _load_archive(force_full, anno=None):
+    if anno is None: anno = current_partition()
+    mirror = sync_archive_mirror(force_full, anno)
+    version = (anno, mirror.version())
+    cached = _resources.get("archive_df")
+    if cached is not None and cached[0] == version: return cached[1]
+    header, rows = mirror.records()
+    import pandas as pd
+    from archive_schema import build_archive_frame
+    if not rows: return pd.DataFrame()
+    df = build_archive_frame(header, rows)
+    _resources["archive_df"] = (version, df)
+    return df
+
+def get_search_index(df, anno=None):
+    import pandas as pd
+    # Un indice per generazione della copia locale; le righe aggiunte vengono solo accodate
+    if anno is None: anno = current_partition()
+    generation = (anno, get_archive_mirror(anno).version()[0])
+    with _resources_lock:
+        cached = _resources.get("search_index")
+        if cached is None or cached[0] != generation or len(cached[1]) > len(df):
+            cached = (generation, SearchIndex())
+            _resources["search_index"] = cached
+        index = cached[1]
+        if len(index) < len(df):
+            cols = [df[c].iloc[len(index):] if c in df.columns else pd.Series("", index=df.index[len(index):])
+                    for c in SEARCH_FIELDS]
+            index.add(zip(*(c.astype(object).where(c.notna(), "").tolist() for c in cols)))
+    return index
+
+def get_sales_aggregates(anno=None):
+    # Totali di un anno (default: quello in uso); gli anni chiusi vengono ricalcolati al rollover
+    if anno is None: anno = current_partition()
+    return _partition_resource("analytics", anno, lambda: SalesAggregates(_partition_db("analisi", anno)))
+
+def load_sales_analytics(force_full=False):
+    # Aggiunge ai totali solo le righe arrivate nella copia locale dall'ultima volta
+    anno = current_partition()
+    mirror = sync_archive_mirror(force_full, anno)
+    aggregates = get_sales_aggregates(anno)
+    with span("analisi.aggiornamento"):
+        aggregates.update(mirror)
+    return aggregates
 
 # --- FUNZIONI DI UTILITÀ ---
-def clean_text(text):
-    if not isinstance(text, str): return str(text)
-    replacements = {'\u2022': '-', '\u201c': '"', '\u201d': '"', '\u2018': "'", '\u2019': "'", '\u2013': '-', '\u20ac': 'Euro'}
-    for k, v in replacements.items(): text = text.replace(k, v)
-    return text.encode('latin-1', 'replace').decode('latin-1')
+def create_pdf(data):
+    import pdf_render
+    return pdf_render.create_pdf(data, compact=PDF_COMPACT)
 
 def safe_int(value, default=0):
     try:
@@ -114,6 +666,102 @@ def safe_int(value, default=0):
     except:
         return default
 
+def format_euro(value):
+    # 1234.5 -> "1.234,50"
+    return f"{value:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+
+def parse_price(value):
+    # Prezzi salvati in formato italiano ("1.234,50"); i valori gia' numerici (archivio tipizzato) passano invariati
+    if isinstance(value, (int, float)): return 0.0 if math.isnan(value) else float(value)
+    return float(str(value).replace('.', '').replace(',', '.')) if str(value).strip() else 0.0
+
+def row_to_quote_data(row):
+    # Riga dell'archivio (o del CSV) -> dizionario per create_pdf
+    return {
+        'preventivo_id': row['ID_Preventivo'],
+        'user_name': row['Venditrice'],
+        'cliente': row['Cliente'],
+        'email': row.get('Email', ''),
+        'prezzo_1': parse_price(row.get('Prezzo Tot', 0)),
+        'prezzo_2': parse_price(row.get('Prezzo Biennale', '')),
+        'zone': str(row.get('Zone', '')).split(", "),
+        'tipologia': row.get('Tipologia', ''),
+        'esiti': row.get('Esiti', 'No'),
+        'analisibando_qty': safe_int(row.get('Analisi Qty')),
+        'pagamento': row.get('Pagamento', ''),
+        'scadenza_rate': row.get('Scadenza Rate', ''),
+        'validita': safe_int(row.get('Validita'), 15),
+        'note': row.get('Note', ''),
+        'anno': quote_year(row.get('Data'))
+    }
+
+def quote_fingerprint(row):
+    # Impronta dei campi della riga che finiscono nel PDF (riga salvata o dell'archivio tipizzato):
+    # cambia se il preventivo viene modificato nel foglio dopo la generazione
+    import pandas as pd
+    def plain(value):
+        if isinstance(value, list): return [plain(v) for v in value]
+        if value is None or (not isinstance(value, str) and pd.isna(value)): return ""
+        return str(value).strip()
+    data = row_to_quote_data(row)
+    data.pop('preventivo_id')
+    return content_hash({k: plain(v) for k, v in data.items()})
+
+def quote_year(value):
+    # Anno di una Data dell'archivio (Timestamp o testo "AAAA-MM-GG ..."), None se assente
+    if hasattr(value, 'year'): return value.year if value == value else None  # NaT
+    text = str(value or "").strip()
+    return int(text[:4]) if text[:4].isdigit() else None
+
+def quote_file_name(data, prefix="Preventivo"):
+    cliente = "".join(c if c.isalnum() or c in "-_." else "_" for c in str(data['cliente']))
+    return f"{prefix}_{data['preventivo_id']}_{cliente}.pdf"
+
+def filter_archive(df, index, search_text="", user_filter="Tutti", date_from=None, date_to=None):
+    if df.empty: return df  # es. primo giorno dell'anno con l'archivio diviso
+    mask = archive_mask(df, index, search_text, user_filter, date_from, date_to)
+    return df if mask.all() else df[mask]
+
+def archive_mask(df, index, search_text="", user_filter="Tutti", date_from=None, date_to=None):
+    # Maschere sulle colonne tipizzate, combinate in un unico array booleano
+    import numpy as np
+    import pandas as pd
+    mask = np.ones(len(df), dtype=bool)
+    if search_text:
+        found = np.zeros(len(df), dtype=bool)
+        found[index.search(search_text)] = True
+        mask &= found
+    
+    if user_filter != "Tutti":
+        mask &= (df['Venditrice'] == user_filter).to_numpy(dtype=bool, na_value=False)
+
+    if date_from:
+        mask &= (df['Data'] >= pd.Timestamp(date_from)).to_numpy(dtype=bool, na_value=False)
+    if date_to:
+        mask &= (df['Data'] < pd.Timestamp(date_to) + pd.Timedelta(days=1)).to_numpy(dtype=bool, na_value=False)
+    return mask
+
+def paginate_archive(df_filt, sort_key, page, page_size=None):
+    # Ordina solo le posizioni (argsort sulla colonna tipizzata) e restituisce la fetta della pagina
+    import numpy as np
+    page_size = page_size or RESULTS_PAGE_SIZE
+    column, descending = SORT_OPTIONS[sort_key]
+    values = df_filt[column]
+    if column == 'Data': keys = values.to_numpy(dtype="datetime64[ns]")
+    else: keys = values.to_numpy(dtype="float64", na_value=np.nan)
+    order = np.argsort(keys, kind="stable")
+    if descending: order = order[::-1]
+    missing = values.isna().to_numpy()[order]
+    order = np.concatenate([order[~missing], order[missing]])  # righe senza data/ID sempre in fondo
+    start = (page - 1) * page_size
+    return df_filt.iloc[order[start:start + page_size]]
+
+def iter_archive_rows(df):
+    # Righe del DataFrame come dict, una alla volta
+    cols = list(df.columns)
+    for values in df.itertuples(index=False, name=None):
+        yield dict(zip(cols, values))
+
 def clear_form():
     st.session_state["k_cliente"] = ""
     st.session_state["k_email"] = ""
@@ -155,199 +803,159 @@ def check_password():
         return False
     return True
 
-# --- 2. PDF GENERATOR ---
-class PDF(FPDF):
-    def header(self):
-        if os.path.exists(LOGO_PATH): self.image(LOGO_PATH, 10, 8, 45) 
-        self.set_font('Helvetica', 'B', 9)
-        self.set_text_color(*COLOR_TEXT)
-        self.set_xy(100, 8)
-        self.cell(100, 4, COMPANY_NAME, ln=True, align='R')
-        self.set_font('Helvetica', '', 8)
-        self.cell(0, 4, COMPANY_ADDR, ln=True, align='R')
-        self.cell(0, 4, COMPANY_P_IVA, ln=True, align='R')
-        self.set_text_color(*COLOR_PRIMARY)
-        self.cell(0, 4, COMPANY_WEB, ln=True, align='R')
-        self.set_xy(10, 32)
-        self.set_draw_color(*COLOR_PRIMARY)
-        self.set_line_width(0.8)
-        self.line(10, 32, 200, 32)
-    def footer(self):
-        self.set_y(-12)
-        self.set_font('Helvetica', 'I', 7)
-        self.set_text_color(150, 150, 150)
-        self.cell(0, 4, f'Presidia Group srl - {COMPANY_WEB} - Pagina {self.page_no()}', ln=True, align='C')
+def render_bulk_zip(rows, total):
+    bar = st.progress(0.0, text="Generazione PDF...")
+    def progress(done, tot, n_err):
+        bar.progress(min(done / tot, 1.0) if tot else 0.0, text=f"Generati {done}{f'/{tot}' if tot else ''} (errori: {n_err})")
+    with tempfile.TemporaryFile() as tmp:
+        result = render_zip(rows, tmp, row_to_quote_data, progress=progress, total=total)
+        bar.progress(1.0, text=f"Completato: {result['generati']} PDF")
+        for key, msg in result['errori'][:20]:
+            st.error(f"{key}: {msg}")
+        if len(result['errori']) > 20: st.error(f"... altri {len(result['errori']) - 20} errori (vedi errori.txt nello ZIP)")
+        tmp.seek(0)  # st.download_button non accetta il file temporaneo (BufferedRandom): si passano i byte
+        st.download_button("⬇️ Scarica ZIP", tmp.read(), f"Preventivi_{datetime.now().strftime('%Y%m%d_%H%M')}.zip", 'application/zip')
 
-def create_pdf(data):
-    pdf = PDF()
-    pdf.set_auto_page_break(auto=True, margin=10)
-    pdf.add_page()
-    pdf.set_y(36)
-    pdf.set_font('Helvetica', 'B', 9)
-    pdf.set_text_color(80, 80, 80)
-    commerciale = data.get('user_name', 'N.D.')
-    pdf.cell(0, 4, f"COMMERCIALE DI RIFERIMENTO: {clean_text(commerciale)}", ln=True)
-    pdf.set_y(44)
-    pdf.set_font('Helvetica', 'B', 13)
-    pdf.set_text_color(*COLOR_PRIMARY)
-    title = "PREVENTIVO SERVIZI DI\nABBONAMENTO INFO GARE ED ESITI"
-    y_start = pdf.get_y()
-    pdf.multi_cell(95, 6, title)
-    pdf.set_xy(110, y_start) 
-    pdf.set_fill_color(*COLOR_LIGHT_GRAY)
-    pdf.set_draw_color(220, 220, 220)
-    pdf.set_line_width(0.2)
-    pdf.rect(110, y_start, 90, 28, 'FD') 
-    pdf.set_xy(115, y_start + 3)
-    pdf.set_font('Helvetica', 'B', 10)
-    pdf.set_text_color(0, 0, 0)
-    pdf.cell(80, 5, clean_text(f"Spett.le {data['cliente']}"), ln=True)
-    pdf.set_font('Helvetica', '', 9)
-    pdf.set_x(115)
-    pdf.cell(80, 5, clean_text(f"Email: {data['email']}"), ln=True)
-    pdf.set_x(115)
-    anno = datetime.now().year
-    pdf.cell(80, 5, f"Preventivo N.: {anno}/{str(data['preventivo_id']).zfill(3)}", ln=True)
-    pdf.set_x(115)
-    pdf.cell(80, 5, f"Data: {datetime.now().strftime('%d/%m/%Y')}", ln=True)
-    pdf.set_y(y_start + 34)
-
-    def draw_box(title, z, t):
-        pdf.set_font('Helvetica', 'B', 10)
-        pdf.set_text_color(255, 255, 255)
-        pdf.set_fill_color(*COLOR_PRIMARY)
-        pdf.cell(190, 7, f"  {title}", 0, 1, 'L', True)
-        y = pdf.get_y()
-        pdf.set_text_color(*COLOR_TEXT)
-        pdf.set_fill_color(255, 255, 255)
-        pdf.set_y(y + 3)
-        pdf.set_x(15)
-        pdf.set_font('Helvetica', 'B', 9)
-        pdf.cell(45, 5, "COPERTURA GEOGRAFICA:", 0, 0)
-        pdf.set_font('Helvetica', '', 9)
-        pdf.multi_cell(130, 5, clean_text(z))
-        pdf.set_x(15)
-        pdf.set_font('Helvetica', 'B', 9)
-        pdf.cell(45, 5, "TIPOLOGIA GARE:", 0, 0)
-        pdf.set_font('Helvetica', '', 9)
-        pdf.multi_cell(130, 5, clean_text(t))
-        pdf.ln(2)
-        h = pdf.get_y() - y
-        pdf.set_draw_color(200, 200, 200)
-        pdf.rect(10, y, 190, h, 'D')
-        pdf.ln(4)
-
-    z_str = ", ".join(data['zone'])
-    draw_box("CARATTERISTICHE SERVIZIO INFO GARE", z_str, data['tipologia'])
-    st_es = "SI" if data['esiti'] == "Sì" else "NO"
-    draw_box(f"CARATTERISTICHE SERVIZIO INFO ESITI ({st_es})", z_str, data['tipologia'])
-    
-    pdf.ln(4)
-    pdf.set_font('Helvetica', 'B', 11)
-    pdf.set_text_color(*COLOR_PRIMARY)
-    pdf.cell(0, 8, 'PROPOSTA ECONOMICA', ln=True)
-    pdf.set_fill_color(*COLOR_PRIMARY)
-    pdf.set_text_color(255, 255, 255)
-    pdf.set_font('Helvetica', 'B', 9)
-    pdf.cell(95, 7, '  Tipologia Servizio', 0, 0, 'L', True)
-    pdf.cell(30, 7, 'Imponibile', 0, 0, 'R', True)
-    pdf.cell(25, 7, 'IVA (22%)', 0, 0, 'R', True)
-    pdf.cell(40, 7, 'Totale  ', 0, 1, 'R', True)
-    
-    def add_row(d, p):
-        iva = p * 0.22
-        tot = p + iva
-        pdf.set_text_color(0, 0, 0)
-        pdf.set_font('Helvetica', '', 9)
-        x = pdf.get_x()
-        y = pdf.get_y()
-        pdf.set_draw_color(230, 230, 230)
-        pdf.line(x, y+8, x+190, y+8)
-        pdf.cell(95, 8, "  " + clean_text(d), 0, 0, 'L')
-        pdf.cell(30, 8, f"E. {p:,.2f}", 0, 0, 'R')
-        pdf.cell(25, 8, f"E. {iva:,.2f}", 0, 0, 'R')
-        pdf.set_font('Helvetica', 'B', 9)
-        pdf.cell(40, 8, f"E. {tot:,.2f}  ", 0, 1, 'R')
-
-    add_row('Abbonamento Annuale (12 Mesi)', data['prezzo_1'])
-    if data['prezzo_2'] > 0: add_row('Abbonamento Biennale (24 Mesi)', data['prezzo_2'])
-    if data['analisibando_qty'] > 0: add_row(f"Pacchetto ANALISI BANDO PRO ({data['analisibando_qty']} Report)", PREZZI_ANALISI[data['analisibando_qty']])
-    
-    pdf.ln(8)
-    by = pdf.get_y()
-    pdf.set_fill_color(*COLOR_BONUS_BG)
-    pdf.set_draw_color(*COLOR_PRIMARY)
-    pdf.rect(10, by, 190, 20, 'FD')
-    pdf.set_xy(15, by + 4)
-    pdf.set_font('Helvetica', 'B', 9)
-    pdf.set_text_color(0, 0, 0)
-    pdf.cell(30, 4, "BONUS INCLUSO:", ln=False)
-    pdf.set_font('Helvetica', '', 9)
-    pdf.set_xy(45, by + 4)
-    pdf.multi_cell(150, 4, "In caso di sottoscrizione del servizio entro il periodo di validita del presente Preventivo, sara riconosciuto un bonus di 2 Polizze Fideiussorie Gratuite del valore di 70 euro (per importi cauzionali fino a 19.000,00 euro).")
-    pdf.set_y(by + 26)
-
-    pdf.set_font('Helvetica', 'B', 9)
-    pdf.cell(25, 6, "Pagamento:", ln=False)
-    pdf.set_font('Helvetica', '', 9)
-    pdf.cell(60, 6, clean_text(data['pagamento']), ln=False)
-    pdf.set_font('Helvetica', 'B', 9)
-    pdf.cell(30, 6, "Scadenza Rate:", ln=False)
-    pdf.set_font('Helvetica', '', 9)
-    pdf.cell(0, 6, clean_text(data['scadenza_rate']), ln=True)
-    
+def export_archive_file(df, formato):
+    # Scritto a blocchi su file temporaneo; chiamata da st.download_button solo al clic.
+    # Si restituiscono i byte: il runtime rifiuta il file temporaneo (BufferedRandom)
+    from export import write_export
+    with tempfile.TemporaryFile() as tmp:
+        with span(f"esportazione.{formato}"):
+            write_export(df, tmp, formato)
+        tmp.seek(0)
+        return tmp.read()
+
+def render_reprint(row):
+    # PDF originale se conservato e generato dagli stessi dati, altrimenti rigenerato dalla riga
     try:
-        scad = (datetime.now() + timedelta(days=int(data['validita']))).strftime('%d/%m/%Y')
-    except:
-        scad = (datetime.now() + timedelta(days=15)).strftime('%d/%m/%Y')
-        
-    pdf.set_font('Helvetica', 'I', 9)
-    pdf.set_text_color(100, 100, 100)
-    pdf.cell(0, 6, f"Offerta valida fino al: {scad}", ln=True)
-    
-    if data['note']:
-        pdf.ln(3)
-        pdf.set_font('Helvetica', 'B', 9)
-        pdf.set_text_color(*COLOR_PRIMARY)
-        pdf.cell(0, 5, 'NOTE:', ln=True)
-        pdf.set_font('Helvetica', '', 8)
-        pdf.set_text_color(0, 0, 0)
-        pdf.multi_cell(0, 4, clean_text(data['note']))
-
-    y_curr = pdf.get_y()
-    y_start_box = max(y_curr + 10, 238)
-    if y_curr > 230 and y_curr < 250: y_start_box = y_curr + 5
-    elif y_curr >= 250:
-         pdf.add_page()
-         y_start_box = 30
-    pdf.set_y(y_start_box)
-    pdf.set_fill_color(*COLOR_PRIMARY)
-    pdf.rect(10, y_start_box, 190, 7, 'F')
-    pdf.set_xy(10, y_start_box + 1.5)
-    pdf.set_font('Helvetica', 'B', 10)
-    pdf.set_text_color(255, 255, 255)
-    pdf.cell(190, 5, "SERVIZI OPZIONALI OFFERTI DA PRESIDIA GROUP", ln=True, align='C')
-    pdf.set_fill_color(*COLOR_OPTIONAL_BG)
-    pdf.set_draw_color(*COLOR_PRIMARY)
-    pdf.rect(10, y_start_box + 7, 190, 28, 'FD')
-    pdf.set_xy(15, y_start_box + 10)
-    pdf.set_font('Helvetica', '', 9)
-    pdf.set_text_color(*COLOR_TEXT)
-    pdf.cell(4, 6, "-", ln=False)
-    pdf.cell(85, 6, "Business Intelligence su Analisi Ribassi Storici", ln=True)
-    pdf.set_x(15)
-    pdf.cell(4, 6, "-", ln=False)
-    pdf.cell(85, 6, "Assistenza Legale di 1 Livello", ln=True)
-    pdf.set_xy(105, y_start_box + 10)
-    pdf.cell(4, 6, "-", ln=False)
-    pdf.multi_cell(85, 6, "Preparazione Documentale di Gara\n(Predisposizione e Caricamento sul Portale)")
-    pdf.set_xy(105, pdf.get_y() + 1)
-    pdf.cell(4, 6, "-", ln=False)
-    pdf.cell(85, 6, "Avvalimenti", ln=True)
-    
-    return pdf.output(dest='S').encode('latin-1', 'replace')
+        with span("ristampa.archivio_pdf"):
+            pdf_bytes_re = get_pdf_store().get(row['ID_Preventivo'], quote_fingerprint(row))
+        file_name_re = f"Ristampa_Prev_{row['ID_Preventivo']}_{row['Cliente']}.pdf"
+        if pdf_bytes_re is not None:
+            st.caption("Copia identica al PDF originale.")
+            st.download_button("⬇️ Scarica PDF Originale", pdf_bytes_re, file_name_re, 'application/pdf')
+        else:
+            data_reprint = row_to_quote_data(row)
+            with span("ristampa.pdf"):
+                pdf_bytes_re = create_pdf(data_reprint)
+            st.download_button("⬇️ Scarica PDF Rigenerato", pdf_bytes_re, file_name_re, 'application/pdf')
+
+    except Exception as e:
+        st.error(f"Errore rigenerazione: {e}. Controllare i dati nel DB.")
+
+def render_history_search(search_text, user_filter):
+    # Anni chiusi: ricerca sull'indice locale; la riga completa si legge dal foglio solo per la ristampa
+    st.markdown("---")
+    st.markdown("**🗂️ Anni precedenti**")
+    index = get_partition_index()
+    pending = [y for y in partition_years() if y < datetime.now().year and y not in index.indexed_years()]
+    if pending: st.caption(f"⏳ Indice in aggiornamento per: {', '.join(map(str, pending))}.")
+    if not search_text:
+        st.caption("Scrivere nel campo di ricerca per cercare anche negli anni precedenti.")
+        return
+    with span("archivio.ricerca_storica"):
+        found = index.search(search_text, user_filter, limit=HISTORY_RESULTS)
+    if not found:
+        st.caption("Nessun preventivo trovato negli anni precedenti.")
+        return
+    st.write(f"Trovati: {len(found)}{' (primi)' if len(found) == HISTORY_RESULTS else ''}")
+    st.dataframe([{"Anno": r["anno"], "ID_Preventivo": r["preventivo_id"], "Data": r["data"],
+                   "Venditrice": r["venditrice"], "Cliente": r["cliente"]} for r in found], hide_index=True)
+    labels = {(r["anno"], r["riga"], r["preventivo_id"]): f"{r['anno']} - ID: {r['preventivo_id']} - {r['cliente']} ({r['data']})"
+              for r in found}
+    selected = st.selectbox("Seleziona preventivo di un anno precedente:", list(labels), format_func=labels.get,
+                            key="k_selezione_storico")
+    if st.button("🖨️ Ristampa (anno precedente)"):
+        try:
+            with span("ristampa.lettura_anno_chiuso"):
+                row = load_partition_row(*selected)
+        except Exception as e:
+            st.error(f"Errore lettura archivio {selected[0]}: {e}")
+            return
+        render_reprint(row)
+
+def render_timing_panel():
+    st.subheader("⏱️ Tempi di risposta per fase")
+    st.caption(f"Ultime {timing.MAX_SAMPLES} misure per fase, dall'avvio del processo.")
+    rows = timing.STORE.summary()
+    if rows: st.dataframe(rows, hide_index=True)
+    else: st.info("Nessuna misura ancora registrata.")
+    c = timing.STORE.counters()
+    calls = c.get("sheets.chiamate", 0)
+    k1, k2, k3, k4, k5 = st.columns(5)
+    k1.metric("Chiamate Sheets", calls)
+    k2.metric("Errori Sheets", c.get("sheets.errori", 0), f"{c.get('sheets.errori', 0) / calls:.1%}" if calls else None, delta_color="inverse")
+    k3.metric("Ripetizioni Sheets", c.get("sheets.ripetizioni", 0), f"{c.get('sheets.ripetizioni', 0) / calls:.1%}" if calls else None, delta_color="inverse")
+    k4.metric("Errori quota (429)", c.get("sheets.quota", 0),
+              f"attese limite: {c.get('sheets.attese_limite', 0)}" if c.get("sheets.attese_limite") else None, delta_color="off")
+    k5.metric("Invii coda falliti", c.get("coda.tentativi_falliti", 0))
+    if st.button("Azzera misure"):
+        timing.STORE.clear()
+        st.rerun()
+
+def render_analytics_panel():
+    st.subheader("📊 Analisi Vendite")
+    current = current_partition()
+    closed = [y for y in reversed(get_partition_index().indexed_years()) if y != current] if current else []
+    anno = st.selectbox("Anno", [current] + closed, key="k_analisi_anno") if closed else current
+    force_full = st.button("🔄 Aggiorna Analisi")
+    if anno == current:
+        aggregates = load_sales_analytics(force_full)
+    else:
+        aggregates = get_sales_aggregates(anno)  # anno chiuso: totali calcolati al rollover
+    totale = aggregates.table("totale")
+    if anno == current and render_stale_warning(not totale): return
+    if not totale:
+        st.info("Database vuoto.")
+        return
+    t = totale[0]
+    k1, k2, k3, k4 = st.columns(4)
+    k1.metric("Preventivi", t["preventivi"])
+    k2.metric("Totale Annuale", f"€ {format_euro(t['totale_annuale'])}")
+    k3.metric("Totale Biennale", f"€ {format_euro(t['totale_biennale'])}")
+    k4.metric("Adesione Analisi Bando", f"{t['adesione_analisi']:.1%}".replace(".", ","))
+
+    def rows(dimensione, label, empty):
+        return [{label: r["chiave"] or empty,
+                 "Preventivi": r["preventivi"],
+                 "Totale Annuale (€)": format_euro(r["totale_annuale"]),
+                 "Con Biennale": r["con_biennale"],
+                 "Totale Biennale (€)": format_euro(r["totale_biennale"]),
+                 "Con Analisi Bando": r["con_analisi"],
+                 "Adesione Analisi": f"{r['adesione_analisi']:.1%}".replace(".", ","),
+                 "Analisi Qty": r["analisi_qty"]}
+                for r in aggregates.table(dimensione)]
+
+    st.markdown("**Per Commerciale**")
+    st.dataframe(rows("venditrice", "Commerciale", "(non indicato)"), hide_index=True)
+    st.markdown("**Per Mese**")
+    mesi = rows("mese", "Mese", "(senza data)")
+    st.bar_chart([m for m in reversed(mesi) if m["Mese"] != "(senza data)"], x="Mese", y="Preventivi")
+    st.dataframe(mesi, hide_index=True)
+    st.markdown("**Per Zona**")
+    st.caption("Un preventivo su piu' zone viene contato in ciascuna.")
+    st.dataframe(rows("zona", "Zona", "(nessuna)"), hide_index=True)
 
 # --- 4. INTERFACCIA ---
+# Widget delle schede: quando una scheda non viene eseguita Streamlit scarterebbe
+# il loro stato, quindi i valori vengono riscritti in session_state
+KEYS_GENERA = ("k_cliente", "k_email", "k_prezzo1", "k_opz_biennale", "k_prezzo2", "k_zone", "k_tipologia",
+               "k_esiti", "k_analisi", "k_pagamento", "k_scadenza", "k_validita", "k_note")
+KEYS_ARCHIVIO = ("k_cerca", "k_filtro_utente", "k_da", "k_a", "k_ordina", "k_pagina", "k_selezione", "k_selezione_storico")
+
+def is_open(tab, keys=()):
+    # Scheda chiusa: i valori dei suoi widget restano in session_state per il ritorno
+    if tab.open: return True
+    for key in keys:
+        if key in st.session_state: st.session_state[key] = st.session_state[key]
+    return False
+
+TAB_GENERA = "📝 Genera Preventivo"
+TAB_ARCHIVIO = "🔍 Cerca & Ristampa"
+TAB_ANALISI = "📊 Analisi"
+TAB_TEMPI = "⏱️ Tempi"
+
 def main():
     st.set_page_config(page_title="Presidia Preventivi", page_icon="📄", layout="wide")
     if not check_password(): return
@@ -360,166 +968,175 @@ def main():
         st.write(f"Commerciale: **{st.session_state['user_name']}**")
     st.markdown("---")
 
-    tab1, tab2 = st.tabs(["📝 Genera Preventivo", "🔍 Cerca & Ristampa"])
+    is_admin = st.session_state['user_name'] == "ADMIN"
+    tab_labels = [TAB_GENERA, TAB_ARCHIVIO] + ([TAB_ANALISI, TAB_TEMPI] if is_admin else [])
+    # Solo la scheda aperta viene eseguita: l'archivio non si carica finche' non serve
+    tabs = st.tabs(tab_labels, key="k_scheda", on_change="rerun")
+    tab1, tab2 = tabs[0], tabs[1]
 
     # === SCHEDA GENERA ===
     with tab1:
-        c1, c2 = st.columns(2)
-        with c1:
-            st.subheader("1. Dati Cliente")
-            cliente = st.text_input("Ragione Sociale *", key="k_cliente")
-            email = st.text_input("Email", key="k_email")
-            st.subheader("2. Proposta Economica")
-            prezzo_1 = st.number_input("Prezzo Annuale (€) *", step=50.0, key="k_prezzo1")
-            opz_biennale = st.checkbox("Opzione Biennale?", key="k_opz_biennale")
-            prezzo_2 = 0.0
-            if opz_biennale: prezzo_2 = st.number_input("Prezzo Biennale (€)", step=50.0, key="k_prezzo2")
-        with c2:
-            st.subheader("3. Dettagli Servizio")
-            zone = st.multiselect("Zone *", options=LISTA_ZONE, default=["Tutta Italia"], key="k_zone")
-            tipologia = st.text_area("Tipologia Gare *", height=100, key="k_tipologia")
-            esiti = st.radio("Includere Servizio Esiti?", ["Sì", "No"], horizontal=True, key="k_esiti")
-            st.markdown("**Opzioni Extra:**")
-            analisibando_qty = st.selectbox("Analisi Bando Pro (Quantità)", options=[0, 1, 5, 10, 15, 20], key="k_analisi")
-        st.markdown("---")
-        c3, c4 = st.columns(2)
-        with c3:
-            pagamento = st.text_input("Modalità di Pagamento *", value="Bonifico Bancario 30gg d.f.", key="k_pagamento")
-            scadenza_rate = st.text_input("Scadenza Rate", value="Unica Soluzione / Semestrale", key="k_scadenza")
-        with c4:
-            validita = st.number_input("Validità Offerta (giorni)", value=15, step=1, key="k_validita")
-            note = st.text_area("Note aggiuntive", height=68, key="k_note")
-        st.markdown("---")
+        if is_open(tab1, KEYS_GENERA):
+            c1, c2 = st.columns(2)
+            with c1:
+                st.subheader("1. Dati Cliente")
+                cliente = st.text_input("Ragione Sociale *", key="k_cliente")
+                email = st.text_input("Email", key="k_email")
+                st.subheader("2. Proposta Economica")
+                prezzo_1 = st.number_input("Prezzo Annuale (€) *", step=50.0, key="k_prezzo1")
+                opz_biennale = st.checkbox("Opzione Biennale?", key="k_opz_biennale")
+                prezzo_2 = 0.0
+                if opz_biennale: prezzo_2 = st.number_input("Prezzo Biennale (€)", step=50.0, key="k_prezzo2")
+            with c2:
+                st.subheader("3. Dettagli Servizio")
+                zone = st.multiselect("Zone *", options=LISTA_ZONE, default=["Tutta Italia"], key="k_zone")
+                tipologia = st.text_area("Tipologia Gare *", height=100, key="k_tipologia")
+                esiti = st.radio("Includere Servizio Esiti?", ["Sì", "No"], horizontal=True, key="k_esiti")
+                st.markdown("**Opzioni Extra:**")
+                analisibando_qty = st.selectbox("Analisi Bando Pro (Quantità)", options=[0, 1, 5, 10, 15, 20], key="k_analisi")
+            st.markdown("---")
+            c3, c4 = st.columns(2)
+            with c3:
+                pagamento = st.text_input("Modalità di Pagamento *", value="Bonifico Bancario 30gg d.f.", key="k_pagamento")
+                scadenza_rate = st.text_input("Scadenza Rate", value="Unica Soluzione / Semestrale", key="k_scadenza")
+            with c4:
+                validita = st.number_input("Validità Offerta (giorni)", value=15, min_value=1, max_value=MAX_VALIDITA, step=1, key="k_validita")
+                note = st.text_area("Note aggiuntive", height=68, key="k_note")
+            st.markdown("---")
         
-        b1, b2 = st.columns([1,1])
-        with b1:
-            gen_btn = st.button("📄 Genera e Salva PDF", type="primary")
-        with b2:
-            st.button("🔄 Reset Campi", on_click=clear_form)
-
-        if gen_btn:
-            s_esiti = st.session_state["k_esiti"]
+            b1, b2 = st.columns([1,1])
+            with b1:
+                gen_btn = st.button("📄 Genera e Salva PDF", type="primary")
+            with b2:
+                st.button("🔄 Reset Campi", on_click=clear_form)
+
+            if gen_btn:
+                s_esiti = st.session_state["k_esiti"]
+                data_form = {
+                    'preventivo_id': None,
+                    'user_name': st.session_state['user_name'],
+                    'cliente': cliente,
+                    'email': email,
+                    'prezzo_1': prezzo_1,
+                    'prezzo_2': prezzo_2,
+                    'zone': zone,
+                    'tipologia': tipologia,
+                    'esiti': s_esiti,
+                    'analisibando_qty': analisibando_qty,
+                    'pagamento': pagamento,
+                    'scadenza_rate': scadenza_rate,
+                    'validita': validita,
+                    'note': note
+                }
             
-            # --- VALIDAZIONE CAMPI OBBLIGATORI ---
-            errori = []
-            if not cliente: errori.append("Ragione Sociale")
-            if not tipologia: errori.append("Tipologia Gare")
-            if not zone: errori.append("Zone")
-            if prezzo_1 <= 0: errori.append("Prezzo Annuale")
-            if not pagamento: errori.append("Modalità di Pagamento")
-
-            if errori:
-                st.error(f"⚠️ Mancano i seguenti campi obbligatori: {', '.join(errori)}")
-            else:
-                try:
-                    with st.spinner("Salvataggio..."):
-                        next_id = get_next_preventivo_number()
-                        data_form = {
-                            'preventivo_id': next_id,
-                            'user_name': st.session_state['user_name'],
-                            'cliente': cliente,
-                            'email': email,
-                            'prezzo_1': prezzo_1,
-                            'prezzo_2': prezzo_2,
-                            'zone': zone,
-                            'tipologia': tipologia,
-                            'esiti': s_esiti,
-                            'analisibando_qty': analisibando_qty,
-                            'pagamento': pagamento,
-                            'scadenza_rate': scadenza_rate,
-                            'validita': validita,
-                            'note': note
-                        }
-                        
-                        pdf_bytes = create_pdf(data_form)
-                        file_name = f"Preventivo_{next_id}_{cliente.replace(' ', '_')}.pdf"
+                errori = validate_quote(data_form)
+                if errori:
+                    st.error(f"⚠️ Mancano i seguenti campi obbligatori: {', '.join(errori)}")
+                else:
+                    try:
+                        with st.spinner("Salvataggio..."):
+                            pdf_bytes = generate_quote(data_form)
+                            next_id = data_form['preventivo_id']
+                            file_name = f"Preventivo_{next_id}_{cliente.replace(' ', '_')}.pdf"
                         
-                        if save_data_gsheet(data_form):
                             st.success(f"✅ Preventivo N. {next_id} Salvato!")
                             st.download_button("⬇️ Scarica PDF", pdf_bytes, file_name, 'application/pdf')
-                except Exception as e:
-                    st.error(f"Errore: {e}")
+                    except GenerationError as e:
+                        st.error(f"Errore: {e}. Il preventivo non e' stato salvato.")
+                    except Exception as e:
+                        st.error(f"Errore: {e}")
+
+            with st.expander("☁️ Stato sincronizzazione archivio"):
+                recenti = [r for r in get_save_queue().recent(50) if r["riga"][2] == st.session_state['user_name']][:10]
+                if not recenti: st.caption("Nessun preventivo salvato di recente.")
+                for r in recenti:
+                    st.write(f"N. {r['chiave']} - {r['riga'][3]}: {sync_status_label(r)}")
 
     # === SCHEDA RICERCA E RISTAMPA ===
     with tab2:
-        st.subheader("🔍 Archivio e Ristampa")
-        df = load_data_from_gsheet()
+        if is_open(tab2, KEYS_ARCHIVIO):
+            st.subheader("🔍 Archivio e Ristampa")
+            force_full = st.button("🔄 Aggiorna Archivio")
+            pending = get_save_queue().pending_count()
+            if pending: st.caption(f"⏳ {pending} preventivi in attesa di sincronizzazione con l'archivio.")
+            anno = current_partition()
+            if anno: st.caption(f"Archivio {anno}: gli anni precedenti si cercano in fondo alla pagina.")
+            df = load_data_from_gsheet(force_full)
+            unavailable = render_stale_warning(df.empty)
         
-        if not df.empty:
-            df['Data_dt'] = pd.to_datetime(df['Data'], errors='coerce')
-
-            c_fil1, c_fil2, c_fil3, c_fil4 = st.columns([2, 2, 1, 1])
-            with c_fil1: 
-                search_text = st.text_input("Cerca (Cliente o ID)", placeholder="Es. Rossi...")
-            with c_fil2:
-                filter_options = ["Tutti"] + USERS_LIST
-                user_filter = st.selectbox("Filtra Commerciale", filter_options)
-            with c_fil3:
-                date_from = st.date_input("Da:", value=None)
-            with c_fil4:
-                date_to = st.date_input("A:", value=None)
-
-            df_filt = df.copy()
-            if search_text:
-                mask = df_filt.astype(str).apply(lambda x: x.str.contains(search_text, case=False)).any(axis=1)
-                df_filt = df_filt[mask]
-            
-            if user_filter != "Tutti":
-                df_filt = df_filt[df_filt['Venditrice'].astype(str) == user_filter]
+            if not df.empty or anno:
+                c_fil1, c_fil2, c_fil3, c_fil4 = st.columns([2, 2, 1, 1])
+                with c_fil1: 
+                    search_text = st.text_input("Cerca (Cliente o ID)", placeholder="Es. Rossi...", key="k_cerca")
+                with c_fil2:
+                    filter_options = ["Tutti"] + USERS_LIST
+                    user_filter = st.selectbox("Filtra Commerciale", filter_options, key="k_filtro_utente")
+                with c_fil3:
+                    date_from = st.date_input("Da:", value=None, key="k_da")
+                with c_fil4:
+                    date_to = st.date_input("A:", value=None, key="k_a")
 
-            if date_from:
-                df_filt = df_filt[df_filt['Data_dt'].dt.date >= date_from]
-            if date_to:
-                df_filt = df_filt[df_filt['Data_dt'].dt.date <= date_to]
+                index = get_search_index(df)
+                df_filt = filter_archive(df, index, search_text, user_filter, date_from, date_to)
 
-            if not df_filt.empty:
-                st.write(f"Trovati: {len(df_filt)}")
-                
-                options = df_filt.apply(lambda x: f"ID: {x['ID_Preventivo']} - {x['Cliente']} ({x['Data']})", axis=1)
-                selected_option = st.selectbox("Seleziona preventivo da visualizzare:", options)
-                
-                selected_id = int(selected_option.split(" - ")[0].replace("ID: ", ""))
-                row = df[df['ID_Preventivo'] == selected_id].iloc[0]
+                if not df_filt.empty:
+                    n_pages = max(1, -(-len(df_filt) // RESULTS_PAGE_SIZE))
+                    if st.session_state.get("k_pagina", 1) > n_pages: st.session_state["k_pagina"] = 1
+                    c_res1, c_res2, c_res3 = st.columns([2, 2, 1])
+                    with c_res1:
+                        st.write(f"Trovati: {len(df_filt)}")
+                    with c_res2:
+                        sort_key = st.selectbox("Ordina per", list(SORT_OPTIONS), key="k_ordina")
+                    with c_res3:
+                        page = st.number_input(f"Pagina (di {n_pages})", min_value=1, max_value=n_pages, step=1, key="k_pagina")
+
+                    page_df = paginate_archive(df_filt, sort_key, page)
+                    st.dataframe(page_df[[c for c in RESULTS_COLUMNS if c in page_df.columns]], hide_index=True)
+                    export_name = f"Archivio_{datetime.now().strftime('%Y%m%d_%H%M')}"
+                    c_exp1, c_exp2, _ = st.columns([1, 1, 3])
+                    for col, formato in ((c_exp1, "csv"), (c_exp2, "xlsx")):
+                        with col:
+                            st.download_button(f"⬇️ Esporta {formato.upper()} ({len(df_filt)} righe)",
+                                               lambda formato=formato: export_archive_file(df_filt, formato),
+                                               f"{export_name}.{formato}", EXPORT_MIME_TYPES[formato],
+                                               on_click="ignore")
+
+                    # Etichette costruite solo per la pagina visibile; la selezione e' per ID
+                    labels = {pid: f"ID: {pid} - {cli} ({dt})" for pid, cli, dt in
+                              zip(page_df['ID_Preventivo'], page_df['Cliente'], page_df['Data'])}
+                    selected_id = st.selectbox("Seleziona preventivo da visualizzare:", list(labels),
+                                               format_func=labels.get, key="k_selezione")
+                    row = df.iloc[index.lookup_id(selected_id)]
                 
-                st.markdown("---")
-                with st.expander("📋 Vedi Dettagli Completi", expanded=True):
-                    display_data = row.drop(['Data_dt'], errors='ignore').to_dict()
-                    st.write(display_data)
+                    st.markdown("---")
+                    with st.expander("📋 Vedi Dettagli Completi", expanded=True):
+                        display_data = row.to_dict()
+                        st.write(display_data)
 
-                if st.button("🖨️ RIGENERA PDF"):
-                    try:
-                        p1 = float(str(row.get('Prezzo Tot', 0)).replace('.', '').replace(',', '.')) if str(row.get('Prezzo Tot')).strip() else 0.0
-                        p2_val = row.get('Prezzo Biennale', '')
-                        p2 = float(str(p2_val).replace('.', '').replace(',', '.')) if str(p2_val).strip() else 0.0
-                        
-                        data_reprint = {
-                            'preventivo_id': row['ID_Preventivo'],
-                            'user_name': row['Venditrice'],
-                            'cliente': row['Cliente'],
-                            'email': row.get('Email', ''),
-                            'prezzo_1': p1,
-                            'prezzo_2': p2,
-                            'zone': str(row.get('Zone', '')).split(", "),
-                            'tipologia': row.get('Tipologia', ''),
-                            'esiti': row.get('Esiti', 'No'),
-                            'analisibando_qty': safe_int(row.get('Analisi Qty')),
-                            'pagamento': row.get('Pagamento', ''),
-                            'scadenza_rate': row.get('Scadenza Rate', ''),
-                            'validita': safe_int(row.get('Validita'), 15),
-                            'note': row.get('Note', '')
-                        }
-                        
-                        pdf_bytes_re = create_pdf(data_reprint)
-                        file_name_re = f"Ristampa_Prev_{row['ID_Preventivo']}_{row['Cliente']}.pdf"
-                        st.download_button("⬇️ Scarica PDF Rigenerato", pdf_bytes_re, file_name_re, 'application/pdf')
-                        
-                    except Exception as e:
-                        st.error(f"Errore rigenerazione: {e}. Controllare i dati nel DB.")
+                    if st.button("🖨️ RIGENERA PDF"): render_reprint(row)
 
-            else:
-                st.warning("Nessun preventivo corrisponde alla ricerca.")
-        else:
-            st.info("Database vuoto.")
+                    st.markdown("---")
+                    with st.expander("📦 Generazione Massiva (ZIP)"):
+                        bulk_csv = st.file_uploader("CSV preventivi (opzionale, altrimenti i risultati filtrati)", type=["csv"])
+                        n_bulk = "CSV caricato" if bulk_csv else f"{len(df_filt)} preventivi filtrati"
+                        if st.button(f"📦 Genera ZIP ({n_bulk})"):
+                            render_bulk_zip(read_csv_rows(bulk_csv) if bulk_csv else iter_archive_rows(df_filt),
+                                            None if bulk_csv else len(df_filt))
+
+                elif not df.empty:
+                    st.warning("Nessun preventivo corrisponde alla ricerca.")
+                else:
+                    st.info(f"Nessun preventivo nel {anno}.")
+                if anno: render_history_search(search_text, user_filter)
+            elif not unavailable:
+                st.info("Database vuoto.")
+
+    # === SCHEDE ANALISI E TEMPI (solo ADMIN) ===
+    if is_admin:
+        with tabs[2]:
+            if is_open(tabs[2]): render_analytics_panel()
+        with tabs[3]:
+            if is_open(tabs[3]): render_timing_panel()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,190 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# --- COPIA LOCALE DELL'ARCHIVIO ---
+# Il foglio DB_Preventivi viene replicato in SQLite. Ad ogni sincronizzazione:
+#   1. se la revisione Drive (modifiedTime) non e' cambiata non si scarica nulla;
+#   2. altrimenti si scaricano in una sola richiesta l'intestazione, l'ultima riga
+#      gia' nota (ancora) e le righe aggiunte dopo;
+#   3. nella stessa richiesta si rilegge anche un blocco di verify_rows righe gia' note,
+#      a rotazione, per confrontarlo con la copia (modifiche a meta' foglio);
+#   4. si ricarica tutto se intestazione, ancora o blocco non coincidono piu' (riga
+#      modificata/cancellata), se la revisione e' cambiata senza righe nuove (la sola
+#      scrittura dell'app e' l'aggiunta in coda: e' una modifica fatta a mano) oppure
+#      se e' passato troppo tempo dall'ultimo controllo completo.
+# Le letture (ricerca, ristampa) usano solo la copia locale.
+
+def _checksum(values):
+    return hashlib.sha1(json.dumps(values, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+def _trim(values):
+    values = list(values)
+    while values and values[-1] == "": values.pop()
+    return values
+
+class ArchiveMirror:
+    def __init__(self, db_path, run_on_sheet, poll_seconds=30, full_sync_seconds=3600, verify_rows=1000):
+        # run_on_sheet(fn) esegue fn(worksheet) e ne restituisce il risultato
+        self.db_path = db_path
+        self.run_on_sheet = run_on_sheet
+        self.poll_seconds = poll_seconds
+        self.full_sync_seconds = full_sync_seconds
+        self.verify_rows = verify_rows
+        self._lock = threading.Lock()
+        self._last_poll = 0.0
+        self._round = 0        # sincronizzazioni concluse (riuscite o no)
+        self._outcome = None   # (risultato, eccezione) dell'ultima
+        folder = os.path.dirname(db_path)
+        if folder: os.makedirs(folder, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS righe (num INTEGER PRIMARY KEY, valori TEXT NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (chiave TEXT PRIMARY KEY, valore TEXT)")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    # --- metadati ---
+    def _get_meta(self, conn, key, default=None):
+        row = conn.execute("SELECT valore FROM meta WHERE chiave = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def _set_meta(self, conn, key, value):
+        conn.execute("INSERT OR REPLACE INTO meta (chiave, valore) VALUES (?, ?)", (key, json.dumps(value)))
+
+    def state(self):
+        with self._connect() as conn:
+            return {
+                "rows": self._get_meta(conn, "rows", 0),
+                "generation": self._get_meta(conn, "generation", 0),
+                "revision": self._get_meta(conn, "revision"),
+                "last_full_sync": self._get_meta(conn, "last_full_sync", 0),
+                "last_sync": self._get_meta(conn, "last_sync", 0),
+            }
+
+    def version(self):
+        # (generazione, righe): la generazione cambia solo con una ricarica completa,
+        # quindi a parita' di generazione le righe nuove sono sempre in coda
+        s = self.state()
+        return (s["generation"], s["rows"])
+
+    # --- sincronizzazione ---
+    def _revision(self, sheet):
+        try:
+            return sheet.spreadsheet.get_lastUpdateTime()
+        except Exception:
+            return None
+
+    def invalidate(self):
+        # La prossima sync() interroghera' il foglio senza attendere poll_seconds
+        self._last_poll = 0.0
+
+    def sync(self, force_full=False):
+        # Le sessioni che arrivano mentre un'altra sta gia' interrogando il foglio ne
+        # condividono l'esito (anche l'errore) invece di ripetere la stessa lettura
+        started = self._round
+        with self._lock:
+            if self._round != started:
+                changed, error = self._outcome
+                if error is not None: raise error
+                return changed
+            now = time.time()
+            if not force_full and now - self._last_poll < self.poll_seconds:
+                return False
+            try:
+                changed = self.run_on_sheet(lambda sheet: self._sync(sheet, force_full, now))
+            except Exception as e:
+                self._outcome = (False, e)
+                raise
+            finally:
+                self._round += 1
+            self._outcome = (changed, None)
+            self._last_poll = now
+            with self._connect() as conn:
+                self._set_meta(conn, "last_sync", now)
+            return changed
+
+    def _sync(self, sheet, force_full, now):
+        s = self.state()
+        known = s["rows"]
+        if force_full or known == 0 or now - s["last_full_sync"] > self.full_sync_seconds:
+            return self._full_sync(sheet, now)
+
+        revision = self._revision(sheet)
+        if revision is not None and revision == s["revision"]:
+            return False
+
+        # riga 1 = intestazione, riga known + 1 = ultima riga gia' replicata,
+        # righe first + 1 .. last + 1 = blocco di controllo (copia locale: num first .. last)
+        with self._connect() as conn:
+            first = self._get_meta(conn, "verify_from", 1)
+        if first >= known: first = 1
+        last = min(first + self.verify_rows, known) - 1
+        ranges = ["1:1", f"A{known + 1}:ZZ"]
+        if last >= first: ranges.append(f"A{first + 1}:ZZ{last + 1}")
+        header_range, tail_range, *block_range = sheet.batch_get(ranges)
+        header = _trim(header_range[0]) if header_range else []
+        tail = [_trim(r) for r in tail_range]
+        with self._connect() as conn:
+            stored_header = self._get_meta(conn, "header", [])
+            anchor = conn.execute("SELECT valori FROM righe WHERE num = ?", (known,)).fetchone()
+            block = [json.loads(v) for (v,) in conn.execute(
+                "SELECT valori FROM righe WHERE num BETWEEN ? AND ? ORDER BY num", (first, last))]
+        if header != stored_header or not tail or anchor is None or _checksum(tail[0]) != _checksum(json.loads(anchor[0])):
+            return self._full_sync(sheet, now)
+        if block_range and _checksum([_trim(r) for r in block_range[0]]) != _checksum(block):
+            return self._full_sync(sheet, now)
+
+        new_rows = tail[1:]
+        while new_rows and not new_rows[-1]: new_rows.pop()
+        if not new_rows and revision is not None:
+            return self._full_sync(sheet, now)
+        with self._connect() as conn:
+            self._set_meta(conn, "verify_from", last + 1)
+            conn.executemany("INSERT OR REPLACE INTO righe (num, valori) VALUES (?, ?)",
+                             [(known + i + 1, json.dumps(r, ensure_ascii=False)) for i, r in enumerate(new_rows)])
+            self._set_meta(conn, "rows", known + len(new_rows))
+            self._set_meta(conn, "revision", revision)
+        return bool(new_rows)
+
+    def _full_sync(self, sheet, now):
+        revision = self._revision(sheet)
+        values = [_trim(r) for r in sheet.get_all_values()]
+        while values and not values[-1]: values.pop()
+        header = values[0] if values else []
+        rows = values[1:]
+        with self._connect() as conn:
+            old_header = self._get_meta(conn, "header", [])
+            old_rows = [json.loads(v) for (v,) in conn.execute("SELECT valori FROM righe ORDER BY num")]
+            changed = header != old_header or rows != old_rows
+            if changed:
+                conn.execute("DELETE FROM righe")
+                conn.executemany("INSERT INTO righe (num, valori) VALUES (?, ?)",
+                                 [(i + 1, json.dumps(r, ensure_ascii=False)) for i, r in enumerate(rows)])
+                self._set_meta(conn, "header", header)
+                self._set_meta(conn, "rows", len(rows))
+                self._set_meta(conn, "generation", self._get_meta(conn, "generation", 0) + 1)
+            self._set_meta(conn, "revision", revision)
+            self._set_meta(conn, "last_full_sync", now)
+        return changed
+
+    # --- lettura ---
+    def records(self, start=0):
+        # Restituisce (intestazione, righe) con le stringhe come nel foglio (le converte
+        # archive_schema), righe allineate alla lunghezza dell'intestazione.
+        # start = numero di righe da saltare.
+        with self._connect() as conn:
+            header = self._get_meta(conn, "header", [])
+            stored = conn.execute("SELECT valori FROM righe WHERE num > ? ORDER BY num", (start,)).fetchall()
+        width = len(header)
+        rows = []
+        for (v,) in stored:
+            values = json.loads(v)[:width]
+            values += [""] * (width - len(values))
+            rows.append(values)
+        return header, rows
@@ -0,0 +1,58 @@
+import pandas as pd
+
+# --- SCHEMA DELL'ARCHIVIO ---
+# Ogni colonna del foglio viene convertita una sola volta, al caricamento, nel
+# tipo giusto: date con formato esplicito, prezzi italiani ("1.234,50") in float,
+# quantita' in interi, colonne a pochi valori distinti in categorie. I filtri
+# lavorano poi direttamente su questi tipi.
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+INT32_RANGE = (-2**31, 2**31 - 1)
+
+# colonna -> (tipo, valore per celle vuote o non valide)
+ARCHIVE_SCHEMA = {
+    "ID_Preventivo": ("id", None),
+    "Data": ("datetime", None),
+    "Venditrice": ("category", ""),
+    "Cliente": ("text", ""),
+    "Prezzo Tot": ("price", 0.0),
+    "Pagamento": ("category", ""),
+    "Email": ("text", ""),
+    "Prezzo Biennale": ("price", 0.0),
+    "Zone": ("category", ""),
+    "Tipologia": ("text", ""),
+    "Esiti": ("category", "No"),
+    "Analisi Qty": ("int", 0),
+    "Scadenza Rate": ("category", ""),
+    "Validita": ("int", 15),
+    "Note": ("text", ""),
+}
+
+def parse_price_series(s):
+    s = s.astype(str).str.strip().str.replace(".", "", regex=False).str.replace(",", ".", regex=False)
+    return pd.to_numeric(s, errors="coerce")
+
+def _convert(s, kind, default):
+    if kind == "id":
+        return pd.to_numeric(s, errors="coerce").astype("Int64")
+    if kind == "datetime":
+        return pd.to_datetime(s, format=DATE_FORMAT, errors="coerce")
+    if kind == "price":
+        return parse_price_series(s).fillna(default).astype("float64")
+    if kind == "int":
+        values = pd.to_numeric(s.astype(str).str.replace(",", ".", regex=False), errors="coerce")
+        # fuori da int32 astype ricomincerebbe dal fondo (1e12 -> -727379968): vale il predefinito
+        values = values.where(values.between(*INT32_RANGE))
+        return values.fillna(default).astype("int32")
+    if kind == "category":
+        return s.replace("", default).astype("category")
+    return s.astype(str)
+
+def build_archive_frame(header, rows):
+    # rows: valori grezzi (stringhe) come letti dal foglio; le colonne non in schema restano testo
+    df = pd.DataFrame(rows, columns=header)
+    for col in df.columns:
+        if col in ARCHIVE_SCHEMA:
+            kind, default = ARCHIVE_SCHEMA[col]
+            df[col] = _convert(df[col], kind, default)
+    return df
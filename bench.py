@@ -0,0 +1,170 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime
+
+import app
+import pdf_render
+from fake_sheet import fake_archive, FakeWorksheet, synthetic_rows
+
+# --- MICRO-BENCHMARK ---
+# Misura i percorsi caldi senza rete: rendering PDF, funzioni di utilita' e
+# filtri dell'archivio su archivi sintetici (foglio finto in memoria).
+# Uso: python bench.py [--sizes 1000 10000 100000] [--out risultati.json]
+# Il risultato e' JSON: confrontando due file si vede subito una regressione.
+
+BASE_QUOTE = {
+    'preventivo_id': 123, 'user_name': 'MAX', 'cliente': 'Rossi Costruzioni Srl', 'email': 'info@rossi.it',
+    'prezzo_1': 1234.5, 'prezzo_2': 0.0, 'zone': ['Toscana', 'Lazio'], 'tipologia': 'Lavori edili',
+    'esiti': 'Sì', 'analisibando_qty': 0, 'pagamento': 'Bonifico Bancario 30gg d.f.',
+    'scadenza_rate': 'Unica Soluzione / Semestrale', 'validita': 15, 'note': ''
+}
+
+PDF_CASES = {
+    "breve": BASE_QUOTE,
+    "nota_lunga": dict(BASE_QUOTE, prezzo_2=2100.0, analisibando_qty=10, note="Condizioni particolari concordate. " * 40),
+    "multipagina": dict(BASE_QUOTE, prezzo_2=2100.0, analisibando_qty=20, tipologia="Lavori edili, impianti. " * 40,
+                        note="Riga di nota\n" * 60),
+}
+
+def measure(fn, repeat, number=1):
+    fn()  # riscaldamento
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for _ in range(number): fn()
+        times.append((time.perf_counter() - t0) / number * 1000)
+    return {"min_ms": round(min(times), 4), "median_ms": round(statistics.median(times), 4),
+            "mean_ms": round(statistics.mean(times), 4), "repeat": repeat, "number": number}
+
+def bench_rendering(results, repeat):
+    for name, data in PDF_CASES.items():
+        results.append(dict(name="create_pdf", case=name, **measure(lambda: app.create_pdf(data), repeat)))
+    # Uscita classica e compatta a confronto: dimensione del file e tempo di rendering
+    for name, data in PDF_CASES.items():
+        for mode, compact in (("classico", False), ("compatto", True)):
+            size = len(pdf_render.create_pdf(data, compact=compact))
+            results.append(dict(name="pdf_uscita", case=f"{name}/{mode}", bytes=size,
+                                **measure(lambda: pdf_render.create_pdf(data, compact=compact), repeat)))
+
+def bench_utils(results, repeat):
+    short = "Offerta “speciale” – € 100"
+    long = "Testo con caratteri speciali • “virgolette” ‘apici’ – € " * 200
+    results.append(dict(name="clean_text", case="breve", **measure(lambda: pdf_render.clean_text(short), repeat, 1000)))
+    results.append(dict(name="clean_text", case="lungo", **measure(lambda: pdf_render.clean_text(long), repeat, 100)))
+    values = ["15", "15,0", "", None, "abc", 7, "1.5"]
+    results.append(dict(name="safe_int", case="misto", **measure(lambda: [app.safe_int(v) for v in values], repeat, 1000)))
+    prices = ["1.234,50", "450,00", "", "12.345.678,90"]
+    results.append(dict(name="parse_price", case="formato_it", **measure(lambda: [app.parse_price(p) for p in prices], repeat, 1000)))
+
+def bench_archive(results, sizes, repeat):
+    for n in sizes:
+        sheet = fake_archive(n, app.SHEET_COLUMNS)
+        with tempfile.TemporaryDirectory() as tmp:
+            app.reset_resources()
+            app.DATA_DIR = tmp
+            app.set_sheet_factory(lambda: sheet)
+            r = max(3, repeat // max(1, n // 10000))
+
+            t0 = time.perf_counter()
+            df = app.load_data_from_gsheet()
+            results.append({"name": "load_archive", "case": "prima_sincronizzazione", "rows": n,
+                            "min_ms": round((time.perf_counter() - t0) * 1000, 4), "repeat": 1, "number": 1})
+            results.append(dict(name="load_archive", case="da_cache", rows=n, **measure(app.load_data_from_gsheet, r)))
+
+            t0 = time.perf_counter()
+            index = app.get_search_index(df)
+            results.append({"name": "search_index", "case": "costruzione", "rows": n,
+                            "min_ms": round((time.perf_counter() - t0) * 1000, 4), "repeat": 1, "number": 1})
+
+            cases = {
+                "nessun_filtro": {},
+                "cerca": {"search_text": "rossi edil"},
+                "cerca_breve": {"search_text": "12"},
+                "venditrice": {"user_filter": "MAX"},
+                "date": {"date_from": date(2023, 1, 1), "date_to": date(2023, 6, 30)},
+                "combinato": {"search_text": "rossi", "user_filter": "MAX",
+                              "date_from": date(2023, 1, 1), "date_to": date(2023, 12, 31)},
+            }
+            for case, kwargs in cases.items():
+                results.append(dict(name="filter_archive", case=case, rows=n,
+                                    **measure(lambda: app.filter_archive(df, index, **kwargs), r)))
+            app.reset_resources()
+
+def bench_partitions(results, sizes, repeat):
+    # Stesso archivio (distribuito sugli ultimi 3 anni) prima e dopo la divisione per anno:
+    # caricamento a freddo dell'anno in corso e ricerca negli anni chiusi sull'indice locale
+    for n in sizes:
+        start = datetime(datetime.now().year - 2, datetime.now().month, 1)
+        sheet = FakeWorksheet([app.SHEET_COLUMNS] + list(synthetic_rows(n, app.SHEET_COLUMNS, start_date=start)))
+        with tempfile.TemporaryDirectory() as tmp:
+            app.reset_resources()
+            app.DATA_DIR = tmp
+            app.set_sheet_factory(lambda: sheet)
+            rpm = app.SHEETS_PER_MINUTE
+            app.SHEETS_PER_MINUTE = 10 ** 6  # nessuna attesa di quota sul foglio finto
+            try:
+                t0 = time.perf_counter()
+                full = app.load_data_from_gsheet()
+                results.append({"name": "partizioni", "case": "carica_tutto", "rows": len(full),
+                                "min_ms": round((time.perf_counter() - t0) * 1000, 4), "repeat": 1, "number": 1})
+                t0 = time.perf_counter()
+                app.migrate_to_partitions(log=lambda m: None)
+                results.append({"name": "partizioni", "case": "migrazione", "rows": n,
+                                "min_ms": round((time.perf_counter() - t0) * 1000, 4), "repeat": 1, "number": 1})
+                app.reset_resources()
+                app.set_sheet_factory(lambda: sheet)
+                t0 = time.perf_counter()
+                current = app.load_data_from_gsheet()
+                results.append({"name": "partizioni", "case": "carica_anno_corrente", "rows": len(current),
+                                "min_ms": round((time.perf_counter() - t0) * 1000, 4), "repeat": 1, "number": 1})
+                index = app.get_partition_index()
+                for case, query in (("ricerca_storica", "rossi edil"), ("ricerca_storica_id", "123")):
+                    results.append(dict(name="partizioni", case=case, rows=n - len(current),
+                                        **measure(lambda: index.search(query), repeat)))
+            finally:
+                app.SHEETS_PER_MINUTE = rpm
+                app.reset_resources()
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Micro-benchmark Presidia Preventivi")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="Righe degli archivi sintetici")
+    parser.add_argument("--repeat", type=int, default=20, help="Ripetizioni per misura")
+    parser.add_argument("--only", choices=["pdf", "utils", "archive", "partitions"], nargs="+", help="Esegue solo alcuni gruppi")
+    parser.add_argument("--out", help="File JSON di destinazione (default: stdout)")
+    args = parser.parse_args(argv)
+
+    groups = args.only or ["pdf", "utils", "archive", "partitions"]
+    results = []
+    if "pdf" in groups: bench_rendering(results, args.repeat)
+    if "utils" in groups: bench_utils(results, args.repeat)
+    if "archive" in groups: bench_archive(results, args.sizes, args.repeat)
+    if "partitions" in groups: bench_partitions(results, args.sizes, args.repeat)
+
+    report = {
+        "meta": {"git": git_revision(), "python": platform.python_version(), "platform": platform.platform(),
+                 "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S")},
+        "results": results,
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f: f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,17 @@
+# --- DATI AZIENDALI E GRAFICA DEI PREVENTIVI ---
+COMPANY_NAME = "Presidia Group srl"
+COMPANY_ADDR = "Via Vittorio Veneto, 180/1 - AREZZO"
+COMPANY_P_IVA = "P.IVA 07141051214"
+COMPANY_WEB = "www.presidiagroup.it"
+LOGO_PATH = "logo.png"
+
+# Colori del Brand
+COLOR_PRIMARY = (230, 159, 42)     
+COLOR_TEXT = (40, 40, 40)          
+COLOR_LIGHT_GRAY = (248, 248, 248) 
+COLOR_BONUS_BG = (255, 250, 225)   
+COLOR_OPTIONAL_BG = (255, 253, 245) 
+
+PREZZI_ANALISI = {0: 0.00, 1: 5.00, 5: 22.50, 10: 40.00, 15: 52.50, 20: 60.00}
+
+TESTO_BONUS = "In caso di sottoscrizione del servizio entro il periodo di validita del presente Preventivo, sara riconosciuto un bonus di 2 Polizze Fideiussorie Gratuite del valore di 70 euro (per importi cauzionali fino a 19.000,00 euro)."
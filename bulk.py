@@ -0,0 +1,82 @@
+import csv
+import io
+import multiprocessing
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+# --- GENERAZIONE MASSIVA ---
+# I PDF vengono generati in parallelo su piu' processi e scritti nello ZIP man mano
+# che sono pronti: in memoria restano al massimo `max_in_flight` documenti.
+# Gli errori delle singole righe non fermano il lotto: finiscono in errori.txt
+# dentro lo ZIP e nel riepilogo restituito.
+# I processi partono con "spawn", non con fork: Streamlit ha molti thread e un lock
+# tenuto al momento del fork (es. quello del logo) bloccherebbe il figlio per sempre.
+
+def _render(key, data):
+    # Eseguita nei processi figli
+    from app import create_pdf, quote_file_name
+    return key, quote_file_name(data), create_pdf(data)
+
+def read_csv_rows(fileobj):
+    # Legge un CSV esportato dal foglio (separatore ; , o tab) riga per riga
+    if isinstance(fileobj, (bytes, bytearray)): fileobj = io.BytesIO(fileobj)
+    if not isinstance(fileobj, io.TextIOBase): fileobj = io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline="")
+    sample = fileobj.read(4096)
+    fileobj.seek(0)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=";,\t")
+    except csv.Error:
+        dialect = csv.excel
+    for row in csv.DictReader(fileobj, dialect=dialect):
+        yield {k.strip(): (v or "").strip() for k, v in row.items() if k}
+
+def render_zip(rows, out, to_quote_data, workers=None, max_in_flight=None, progress=None, total=None):
+    # rows: righe dell'archivio (dict); to_quote_data(row) -> dati per create_pdf
+    # out: percorso o file binario scrivibile; progress(fatti, totale, errori) opzionale
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or workers * 4
+    import pandas as pd
+    done, errors, names = 0, [], set()
+    with zipfile.ZipFile(out, "w", compression=zipfile.ZIP_STORED) as zf, \
+            ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        pending = {}
+
+        def collect(futures):
+            nonlocal done
+            for fut in futures:
+                key = pending.pop(fut)
+                try:
+                    _, name, pdf_bytes = fut.result()
+                    base, n = name, 1
+                    while name in names:
+                        n += 1
+                        name = f"{base[:-4]}_{n}.pdf"
+                    names.add(name)
+                    zf.writestr(name, pdf_bytes)
+                except Exception as e:
+                    errors.append((key, f"{type(e).__name__}: {e}"))
+                done += 1
+                if progress: progress(done, total, len(errors))
+
+        for i, row in enumerate(rows, start=1):
+            key = row.get("ID_Preventivo")
+            if pd.isna(key) or str(key).strip() == "": key = f"riga {i}"  # pd.NA nell'archivio tipizzato, "" nel CSV
+            try:
+                data = to_quote_data(row)
+            except Exception as e:
+                errors.append((key, f"dati non validi: {type(e).__name__}: {e}"))
+                done += 1
+                if progress: progress(done, total, len(errors))
+                continue
+            pending[pool.submit(_render, key, data)] = key
+            if len(pending) >= max_in_flight:
+                finished, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+                collect(finished)
+        while pending:
+            finished, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+            collect(finished)
+
+        if errors:
+            zf.writestr("errori.txt", "\n".join(f"{k}: {msg}" for k, msg in errors))
+    return {"generati": done - len(errors), "errori": errors}
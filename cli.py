@@ -0,0 +1,183 @@
+import argparse
+import json
+import sys
+import tempfile
+from datetime import date
+
+import app
+from bulk import read_csv_rows, render_zip
+from id_allocator import find_duplicate_ids
+
+# --- STRUMENTI DA RIGA DI COMANDO ---
+# Uso: python cli.py <comando> [opzioni]
+# Le credenziali sono lette da .streamlit/secrets.toml come per l'app.
+
+def cmd_check_duplicates(args):
+    # Con l'archivio diviso la numerazione e' unica per tutti gli anni: si controllano tutti i fogli
+    years = app.partition_years() or [None]
+    col_values = [""]
+    where = [None]
+    for anno in years:
+        col = app.with_google_sheet(lambda sheet: sheet.col_values(1), anno=anno)
+        col_values += col[1:]
+        where += [f"{anno}/{n}" if anno else str(n) for n in range(2, len(col) + 1)]
+    duplicates = find_duplicate_ids(col_values)
+    if not duplicates:
+        print(f"Nessun ID duplicato su {len(col_values) - 1} preventivi.")
+        return 0
+    print(f"Trovati {len(duplicates)} ID duplicati:")
+    for id_prev, rows in sorted(duplicates.items(), key=lambda x: int(x[0]) if x[0].isdigit() else 0):
+        print(f"  ID {id_prev}: righe {', '.join(where[r - 1] for r in rows)}")
+    return 1
+
+def cmd_partition(args):
+    try:
+        counts = app.migrate_to_partitions(dry_run=args.dry_run)
+    except app.PartitionError as e:
+        print(f"ERRORE: {e}", file=sys.stderr)
+        return 1
+    print(f"{sum(counts.values())} preventivi in {len(counts)} fogli per anno"
+          f"{' (prova: nessuna modifica)' if args.dry_run else ''}.")
+    return 0
+
+def cmd_rollover(args):
+    if not app.partition_years():
+        print("L'archivio non e' diviso per anno: eseguire prima 'partiziona'.", file=sys.stderr)
+        return 1
+    years = app.rollover_partitions(force=args.ricostruisci)
+    print(f"Foglio {app.partition_title(app.current_partition())} pronto; "
+          f"anni indicizzati: {', '.join(map(str, years)) or 'nessuno da aggiornare'}.")
+    return 0
+
+def load_filtered_archive(args):
+    df = app.load_data_from_gsheet(anno=args.anno)
+    if df.empty: return df
+    return app.filter_archive(df, app.get_search_index(df, args.anno), args.cerca, args.venditrice, args.da, args.a)
+
+def cmd_bulk(args):
+    def progress(done, total, n_err):
+        print(f"\r{done}{f'/{total}' if total else ''} PDF (errori: {n_err})", end="", file=sys.stderr, flush=True)
+    if args.csv:
+        with open(args.csv, "rb") as f:
+            result = render_zip(read_csv_rows(f), args.out, app.row_to_quote_data, args.workers, progress=progress)
+    else:
+        df = load_filtered_archive(args)
+        result = render_zip(app.iter_archive_rows(df), args.out, app.row_to_quote_data, args.workers,
+                            progress=progress, total=len(df))
+    print(file=sys.stderr)
+    print(f"{result['generati']} PDF scritti in {args.out}")
+    for key, msg in result["errori"]:
+        print(f"  ERRORE {key}: {msg}", file=sys.stderr)
+    return 1 if result["errori"] else 0
+
+def cmd_export(args):
+    import numpy as np
+    from export import write_export
+    formato = args.formato or ("xlsx" if str(args.out).lower().endswith(".xlsx") else "csv")
+    df = app.load_data_from_gsheet(anno=args.anno)
+    # Solo le posizioni delle righe filtrate: le righe vengono lette a blocchi durante la scrittura
+    positions = np.flatnonzero(app.archive_mask(df, app.get_search_index(df, args.anno), args.cerca, args.venditrice,
+                                                args.da, args.a)) if not df.empty else None
+    if args.out == "-":
+        rows = write_export(df, sys.stdout.buffer, formato, positions)
+        sys.stdout.buffer.flush()
+    else:
+        with open(args.out, "wb") as f: rows = write_export(df, f, formato, positions)
+    print(f"{rows} preventivi esportati in {'stdout' if args.out == '-' else args.out}", file=sys.stderr)
+    return 0
+
+def cmd_generate(args):
+    with (sys.stdin if args.json == "-" else open(args.json, encoding="utf-8")) as f:
+        payload = json.load(f)
+    try:
+        data = app.quote_from_payload(payload)
+    except app.QuoteInputError as e:
+        for err in e.errori: print(f"ERRORE: {err}", file=sys.stderr)
+        return 2
+    pdf_bytes = app.generate_quote(data)
+    out = args.out or app.quote_file_name(data)
+    with open(out, "wb") as f: f.write(pdf_bytes)
+    print(f"Preventivo N. {data['preventivo_id']} salvato in {out}")
+    queue = app.get_save_queue()
+    if not queue.drain(30): print("ATTENZIONE: salvataggio ancora in coda, verra' inviato al prossimo avvio", file=sys.stderr)
+    queue.stop(timeout=5)
+    return 0
+
+def cmd_serve(args):
+    import api
+    server = api.make_server(args.host, args.port, args.workers, args.max_pending, verbose=True)
+    print(f"API preventivi su http://{args.host}:{args.port} ({args.workers} worker)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        queue = app.get_save_queue()
+        queue.drain(30)  # attende l'invio al foglio prima di uscire
+        queue.stop(timeout=5)
+    return 0
+
+def add_filter_args(p):
+    p.add_argument("--cerca", default="", help="Testo da cercare (Cliente, ID, Email, Tipologia)")
+    p.add_argument("--venditrice", default="Tutti", help="Filtra per commerciale")
+    p.add_argument("--da", type=date.fromisoformat, help="Data iniziale (AAAA-MM-GG)")
+    p.add_argument("--a", type=date.fromisoformat, help="Data finale (AAAA-MM-GG)")
+    p.add_argument("--anno", type=int, help="Anno dell'archivio diviso (default: anno in corso)")
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="cli.py", description="Strumenti Presidia Preventivi")
+    parser.add_argument("--data-dir", help="Cartella dei dati locali (default: PREVENTIVI_DATA_DIR o ./data)")
+    parser.add_argument("--fake-sheet", type=int, metavar="N",
+                        help="Usa un foglio finto in memoria con N preventivi sintetici al posto di Google Sheets")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("check-duplicates", help="Controlla l'archivio per ID_Preventivo duplicati")
+    p.set_defaults(func=cmd_check_duplicates)
+
+    p = sub.add_parser("partiziona", help="Divide sheet1 in un foglio per anno (con l'app ferma)")
+    p.add_argument("--dry-run", action="store_true", help="Mostra solo quante righe andrebbero in ogni foglio")
+    p.set_defaults(func=cmd_partition)
+
+    p = sub.add_parser("rollover", help="Crea il foglio dell'anno in corso e indicizza gli anni chiusi")
+    p.add_argument("--ricostruisci", action="store_true", help="Reindicizza anche gli anni gia' indicizzati")
+    p.set_defaults(func=cmd_rollover)
+
+    p = sub.add_parser("bulk", help="Genera in parallelo i PDF di un CSV o dell'archivio filtrato in uno ZIP")
+    p.add_argument("--csv", help="CSV con le colonne dell'archivio; se assente usa l'archivio filtrato")
+    p.add_argument("--out", required=True, help="File ZIP di destinazione")
+    p.add_argument("--workers", type=int, help="Processi di rendering (default: numero di CPU)")
+    add_filter_args(p)
+    p.set_defaults(func=cmd_bulk)
+
+    p = sub.add_parser("esporta", help="Esporta l'archivio filtrato in CSV o XLSX")
+    p.add_argument("--out", required=True, help="File di destinazione (- per stdout)")
+    p.add_argument("--formato", choices=["csv", "xlsx"], help="Default: dall'estensione di --out, altrimenti csv")
+    add_filter_args(p)
+    p.set_defaults(func=cmd_export)
+
+    p = sub.add_parser("genera", help="Genera e salva un preventivo da un JSON con i campi del modulo")
+    p.add_argument("--json", required=True, help="File JSON (- per stdin)")
+    p.add_argument("--out", help="File PDF di destinazione")
+    p.set_defaults(func=cmd_generate)
+
+    p = sub.add_parser("serve", help="Avvia l'API HTTP locale (POST /preventivi)")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8765)
+    p.add_argument("--workers", type=int, default=4, help="Richieste servite in parallelo")
+    p.add_argument("--max-pending", type=int, default=32, help="Richieste in attesa oltre le quali si risponde 503")
+    p.set_defaults(func=cmd_serve)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.data_dir: app.DATA_DIR = args.data_dir
+    if args.fake_sheet is not None:
+        from fake_sheet import fake_archive
+        if not args.data_dir: app.DATA_DIR = tempfile.mkdtemp(prefix="preventivi_")
+        sheet = fake_archive(args.fake_sheet, app.SHEET_COLUMNS)
+        app.set_sheet_factory(lambda: sheet)
+    return args.func(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
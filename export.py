@@ -0,0 +1,160 @@
+import csv
+import io
+import re
+import zipfile
+from xml.sax.saxutils import escape
+
+import pandas as pd
+
+from archive_schema import ARCHIVE_SCHEMA
+
+# --- ESPORTAZIONE DELL'ARCHIVIO (CSV / XLSX) ---
+# Le righe vengono scritte a blocchi di CHUNK_ROWS direttamente sul file di
+# destinazione: ogni blocco e' una fetta (iloc) dell'archivio tipizzato,
+# convertita e scritta subito, quindi la memoria non cresce con il numero di
+# righe. CSV: separatore ";", virgola decimale, date gg/mm/aaaa, UTF-8 con BOM
+# (Excel italiano lo apre senza importazione guidata). XLSX: scritto a mano in
+# streaming dentro lo ZIP, con celle numeriche e date vere (formati di Excel
+# che seguono la lingua di chi apre il file).
+
+CHUNK_ROWS = 2000
+FORMATI = ("csv", "xlsx")
+CSV_DATE_FORMAT = "%d/%m/%Y %H:%M"
+
+_EXCEL_EPOCH = pd.Timestamp("1899-12-30")
+_XML_ILLEGAL = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+def _kind(column):
+    return ARCHIVE_SCHEMA.get(column, ("text", ""))[0]
+
+def _column_letter(n):
+    # 1 -> A, 27 -> AA
+    letters = ""
+    while n:
+        n, r = divmod(n - 1, 26)
+        letters = chr(65 + r) + letters
+    return letters
+
+def _chunks(df, positions, chunk_rows):
+    total = len(df) if positions is None else len(positions)
+    for start in range(0, total, chunk_rows):
+        if positions is None: yield df.iloc[start:start + chunk_rows]
+        else: yield df.iloc[positions[start:start + chunk_rows]]
+
+def _csv_column(s, kind):
+    if kind == "datetime":
+        return s.dt.strftime(CSV_DATE_FORMAT).fillna("").tolist()
+    if kind == "price":
+        return [f"{v:.2f}".replace(".", ",") for v in s.tolist()]
+    if kind in ("id", "int"):
+        return ["" if pd.isna(v) else str(int(v)) for v in s.astype(object).tolist()]
+    return s.astype(object).where(s.notna(), "").astype(str).tolist()
+
+def write_csv(df, out, positions=None, chunk_rows=CHUNK_ROWS):
+    # out: stream binario; restituisce il numero di righe scritte
+    text = io.TextIOWrapper(out, encoding="utf-8-sig", newline="", write_through=True)
+    try:
+        writer = csv.writer(text, delimiter=";")
+        writer.writerow(df.columns)
+        kinds = [_kind(c) for c in df.columns]
+        rows = 0
+        for chunk in _chunks(df, positions, chunk_rows):
+            cols = [_csv_column(chunk[c], k) for c, k in zip(chunk.columns, kinds)]
+            writer.writerows(zip(*cols))
+            rows += len(chunk)
+        return rows
+    finally:
+        text.detach()  # il chiamante resta proprietario di out
+
+# --- XLSX ---
+# Stili (cellXfs): 0 testo, 1 data e ora, 2 importo "#,##0.00", 3 intero, 4 intestazione in grassetto
+_STYLE = {"datetime": 1, "price": 2, "id": 3, "int": 3}
+
+_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '</Types>')
+_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+    '</Relationships>')
+_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="{name}" sheetId="1" r:id="rId1"/></sheets></workbook>')
+_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+    '<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>'
+    '</Relationships>')
+_STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font><font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="5">'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="22" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="4" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="1" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/>'
+    '</cellXfs><cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles></styleSheet>')
+
+def _text_cell(value, style=0):
+    value = _XML_ILLEGAL.sub("", str(value))
+    if not value: return "<c/>"
+    attr = f' s="{style}"' if style else ""
+    return f'<c t="inlineStr"{attr}><is><t xml:space="preserve">{escape(value)}</t></is></c>'
+
+def _xlsx_column(s, kind):
+    style = _STYLE.get(kind)
+    if kind == "datetime":
+        serial = ((s - _EXCEL_EPOCH) / pd.Timedelta(days=1)).tolist()
+        return [f'<c s="1"><v>{v!r}</v></c>' if v == v else "<c/>" for v in serial]
+    if style is not None:
+        return ["<c/>" if pd.isna(v) else f'<c s="{style}"><v>{v}</v></c>' for v in s.astype(object).tolist()]
+    return [_text_cell(v) for v in s.astype(object).where(s.notna(), "").tolist()]
+
+def write_xlsx(df, out, positions=None, chunk_rows=CHUNK_ROWS, sheet_name="Preventivi"):
+    # out: stream binario (anche non posizionabile, es. stdout); restituisce il numero di righe scritte
+    kinds = [_kind(c) for c in df.columns]
+    total = len(df) if positions is None else len(positions)
+    last_cell = f"{_column_letter(max(len(df.columns), 1))}{total + 1}"
+    rows = 0
+    with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("[Content_Types].xml", _CONTENT_TYPES)
+        zf.writestr("_rels/.rels", _ROOT_RELS)
+        zf.writestr("xl/workbook.xml", _WORKBOOK.format(name=escape(sheet_name)))
+        zf.writestr("xl/_rels/workbook.xml.rels", _WORKBOOK_RELS)
+        zf.writestr("xl/styles.xml", _STYLES)
+        with zf.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as raw:
+            sheet = io.TextIOWrapper(raw, encoding="utf-8", write_through=True)
+            sheet.write('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                        '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                        f'<dimension ref="A1:{last_cell}"/>'
+                        '<sheetViews><sheetView workbookViewId="0"><pane ySplit="1" topLeftCell="A2" state="frozen"/>'
+                        '</sheetView></sheetViews><sheetData>')
+            sheet.write('<row r="1">' + "".join(_text_cell(c, 4) for c in df.columns) + "</row>")
+            for chunk in _chunks(df, positions, chunk_rows):
+                cols = [_xlsx_column(chunk[c], k) for c, k in zip(chunk.columns, kinds)]
+                sheet.write("".join(f'<row r="{rows + i + 2}">{"".join(cells)}</row>'
+                                    for i, cells in enumerate(zip(*cols))))
+                rows += len(chunk)
+            sheet.write("</sheetData></worksheet>")
+            sheet.detach()
+    return rows
+
+def write_export(df, out, formato, positions=None, chunk_rows=CHUNK_ROWS):
+    if formato not in FORMATI: raise ValueError(f"Formato non supportato: {formato}")
+    writer = write_csv if formato == "csv" else write_xlsx
+    return writer(df, out, positions=positions, chunk_rows=chunk_rows)
@@ -0,0 +1,165 @@
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+
+from gspread.utils import numericise_all
+
+# --- FOGLIO FINTO IN MEMORIA ---
+# Sostituto di gspread.Worksheet per benchmark e prove senza rete: implementa
+# solo i metodi usati dall'app. Si collega con app.set_sheet_factory(lambda: sheet).
+# latency (secondi) e quota_error_rate (probabilita' di un 429 per chiamata)
+# simulano la rete e i limiti di Google per le prove di carico.
+
+class FakeQuotaError(Exception):
+    # Stesso `code` di gspread.exceptions.APIError per un 429
+    code = 429
+
+class FakeClient:
+    # Come gspread.HTTPClient: ogni richiesta del file e dei suoi fogli passa da request()
+    def request(self, *args, **kwargs):
+        pass
+
+class FakeSpreadsheet:
+    def __init__(self, sheet=None):
+        self.revision = 0
+        self.client = FakeClient()
+        self.sheet = sheet
+        self.sheets = [sheet] if sheet is not None else []
+        self._lock = threading.Lock()
+
+    def get_lastUpdateTime(self):
+        if self.sheet is not None: self.sheet._api_call()
+        return f"rev-{self.revision}"
+
+    def worksheets(self):
+        if self.sheet is not None: self.sheet._api_call()
+        with self._lock:
+            return list(self.sheets)
+
+    def add_worksheet(self, title, rows=1000, cols=26, index=None):
+        if self.sheet is not None: self.sheet._api_call()
+        with self._lock:
+            if any(ws.title == title for ws in self.sheets):
+                raise ValueError(f'A sheet with the name "{title}" already exists')
+            ref = self.sheet
+            ws = FakeWorksheet(title=title, latency=ref.latency if ref else 0.0,
+                               quota_error_rate=ref.quota_error_rate if ref else 0.0, spreadsheet=self)
+            self.sheets.insert(len(self.sheets) if index is None else index, ws)
+            self.revision += 1
+            return ws
+
+class FakeWorksheet:
+    def __init__(self, rows=None, title="Foglio1", latency=0.0, quota_error_rate=0.0, seed=None, spreadsheet=None):
+        # spreadsheet: file che contiene il foglio (default: un file nuovo con questo solo foglio)
+        self.title = title
+        self.rows = [[str(v) for v in r] for r in (rows or [])]
+        self.spreadsheet = spreadsheet or FakeSpreadsheet(self)
+        self.client = self.spreadsheet.client
+        self.latency = latency
+        self.quota_error_rate = quota_error_rate
+        self.calls = 0
+        self.quota_errors = 0
+        self._rnd = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _api_call(self):
+        self.client.request()
+        with self._lock:
+            self.calls += 1
+            fail = self.quota_error_rate and self._rnd.random() < self.quota_error_rate
+            if fail: self.quota_errors += 1
+        if self.latency: time.sleep(self.latency)
+        if fail: raise FakeQuotaError("Quota exceeded for quota metric 'Requests per minute per user'")
+
+    def _touch(self):
+        self.spreadsheet.revision += 1
+
+    def get_all_values(self):
+        self._api_call()
+        with self._lock:
+            return [list(r) for r in self.rows]
+
+    def get_all_records(self):
+        self._api_call()
+        with self._lock:
+            if not self.rows: return []
+            header = self.rows[0]
+            return [dict(zip(header, numericise_all(r + [""] * (len(header) - len(r))))) for r in self.rows[1:]]
+
+    def update_title(self, title):
+        self._api_call()
+        self.title = title
+        self._touch()
+
+    def row_values(self, row):
+        self._api_call()
+        with self._lock:
+            values = list(self.rows[row - 1]) if 0 < row <= len(self.rows) else []
+        while values and values[-1] == "": values.pop()
+        return values
+
+    def col_values(self, col):
+        self._api_call()
+        with self._lock:
+            values = [r[col - 1] if len(r) >= col else "" for r in self.rows]
+        while values and values[-1] == "": values.pop()
+        return values
+
+    def batch_get(self, ranges):
+        # Supporta solo intervalli di righe "N:M" / "N:N" e "A<n>:ZZ"
+        self._api_call()
+        out = []
+        with self._lock:
+            for rng in ranges:
+                m = re.fullmatch(r"(\d+):(\d+)", rng)
+                if m:
+                    out.append([list(r) for r in self.rows[int(m.group(1)) - 1:int(m.group(2))]])
+                    continue
+                m = re.fullmatch(r"[A-Z]+(\d+):[A-Z]+(\d*)", rng)
+                if not m: raise ValueError(f"Intervallo non supportato: {rng}")
+                end = int(m.group(2)) if m.group(2) else len(self.rows)
+                out.append([list(r) for r in self.rows[int(m.group(1)) - 1:end]])
+        return out
+
+    def append_row(self, values, **kwargs):
+        self.append_rows([values])
+
+    def append_rows(self, values, **kwargs):
+        self._api_call()
+        with self._lock:
+            self.rows.extend([str(v) for v in r] for r in values)
+            self._touch()
+
+def synthetic_rows(n, columns, seed=42, start_id=1, start_date=datetime(2022, 1, 1)):
+    # Genera n righe plausibili dell'archivio, nell'ordine di `columns`
+    rnd = random.Random(seed)
+    venditrici = ["MAX", "LUCIA VENEZIANO", "SAMANTHA CAPORALINI", "STEFANIA PRETE", "CARLA CAROLEI"]
+    clienti = ["Rossi", "Bianchi", "Edil", "Costruzioni", "Impianti", "Verdi", "Città", "Servizi", "Nord", "Sud"]
+    zone = ["Tutta Italia", "Toscana", "Lazio", "Lombardia", "Campania", "Sicilia", "Veneto"]
+    span = 3 * 365 * 24 * 3600
+    for i in range(n):
+        p1 = rnd.choice([300, 450, 600, 900, 1200, 1500]) + rnd.choice([0, 0.5])
+        values = {
+            "ID_Preventivo": start_id + i,
+            "Data": (start_date + timedelta(seconds=span * i // max(n, 1))).strftime("%Y-%m-%d %H:%M:%S"),
+            "Venditrice": rnd.choice(venditrici),
+            "Cliente": f"{rnd.choice(clienti)} {rnd.choice(clienti)} Srl {i}",
+            "Prezzo Tot": f"{p1:.2f}".replace(".", ","),
+            "Pagamento": "Bonifico Bancario 30gg d.f.",
+            "Email": f"cliente{i}@example.it",
+            "Prezzo Biennale": f"{p1 * 1.8:.2f}".replace(".", ",") if rnd.random() < 0.3 else "0,00",
+            "Zone": ", ".join(rnd.sample(zone, rnd.randint(1, 3))),
+            "Tipologia": rnd.choice(["Lavori edili", "Servizi di pulizia", "Forniture", "Impianti elettrici"]),
+            "Esiti": rnd.choice(["Sì", "No"]),
+            "Analisi Qty": rnd.choice([0, 0, 0, 1, 5, 10, 15, 20]),
+            "Scadenza Rate": "Unica Soluzione / Semestrale",
+            "Validita": rnd.choice([15, 30]),
+            "Note": "" if rnd.random() < 0.7 else "Nota di prova " * rnd.randint(1, 10),
+        }
+        yield [values.get(c, "") for c in columns]
+
+def fake_archive(n, columns, seed=42, **kwargs):
+    # kwargs: latency, quota_error_rate (vedi FakeWorksheet)
+    return FakeWorksheet([columns] + list(synthetic_rows(n, columns, seed)), seed=seed, **kwargs)
@@ -0,0 +1,89 @@
+import os
+import sqlite3
+import threading
+
+# --- NUMERAZIONE PREVENTIVI ---
+# Sequenza locale in SQLite: ogni processo prenota un blocco di ID con una
+# transazione IMMEDIATE (lock in scrittura sul file), quindi due salvataggi
+# contemporanei non possono mai ricevere lo stesso numero. Il foglio viene
+# letto una sola volta, quando la sequenza non esiste ancora, per ripartire
+# dal massimo ID gia' in archivio.
+
+class IdAllocationError(RuntimeError):
+    pass
+
+class IdAllocator:
+    def __init__(self, db_path, seed_fn, block_size=1, name="preventivi"):
+        if block_size < 1: raise ValueError("block_size deve essere >= 1")
+        self.db_path = db_path
+        self.seed_fn = seed_fn
+        self.block_size = block_size
+        self.name = name
+        self._lock = threading.Lock()
+        self._next = 0
+        self._end = 0
+
+    def _connect(self):
+        folder = os.path.dirname(self.db_path)
+        if folder: os.makedirs(folder, exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.execute("CREATE TABLE IF NOT EXISTS sequenze (nome TEXT PRIMARY KEY, ultimo INTEGER NOT NULL)")
+        return conn
+
+    def reserve(self, count):
+        # Prenota `count` ID consecutivi e restituisce il primo
+        try:
+            conn = self._connect()
+        except sqlite3.Error as e:
+            raise IdAllocationError(f"Archivio numerazione non disponibile: {e}") from e
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT ultimo FROM sequenze WHERE nome = ?", (self.name,)).fetchone()
+            if row is None:
+                try:
+                    last = int(self.seed_fn())
+                except Exception as e:
+                    raise IdAllocationError(f"Impossibile leggere l'ultimo ID dall'archivio: {e}") from e
+                conn.execute("INSERT INTO sequenze (nome, ultimo) VALUES (?, ?)", (self.name, last))
+            else:
+                last = row[0]
+            conn.execute("UPDATE sequenze SET ultimo = ? WHERE nome = ?", (last + count, self.name))
+            conn.execute("COMMIT")
+            return last + 1
+        except Exception as e:
+            if conn.in_transaction: conn.execute("ROLLBACK")
+            if isinstance(e, sqlite3.Error): raise IdAllocationError(f"Errore numerazione: {e}") from e
+            raise
+        finally:
+            conn.close()
+
+    def next_id(self):
+        with self._lock:
+            if self._next >= self._end:
+                start = self.reserve(self.block_size)
+                self._next, self._end = start, start + self.block_size
+            value = self._next
+            self._next += 1
+            return value
+
+    def last_issued(self):
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT ultimo FROM sequenze WHERE nome = ?", (self.name,)).fetchone()
+            return row[0] if row else None
+        finally:
+            conn.close()
+
+def max_existing_id(col_values):
+    # col_values: colonna A del foglio, intestazione compresa
+    ids = [int(val) for val in col_values[1:] if str(val).strip().isdigit()]
+    return max(ids) if ids else 0
+
+def find_duplicate_ids(col_values):
+    # Restituisce {id: [righe del foglio]} per gli ID presenti piu' di una volta
+    rows_by_id = {}
+    for row_num, val in enumerate(col_values[1:], start=2):
+        val = str(val).strip()
+        if not val: continue
+        rows_by_id.setdefault(val, []).append(row_num)
+    return {k: v for k, v in rows_by_id.items() if len(v) > 1}
@@ -0,0 +1,266 @@
+import argparse
+import json
+import platform
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+
+import app
+import timing
+from bench import git_revision
+from fake_sheet import fake_archive
+from id_allocator import find_duplicate_ids
+from save_queue import STATO_IN_CODA, STATO_ERRORE
+
+# --- PROVA DI CARICO ---
+# N commerciali simulati usano l'app vera (main() tramite streamlit.testing) nello
+# stesso processo, quindi condividono connessione, copia locale, numerazione e coda
+# come le sessioni di un server Streamlit. Ogni utente, per --iterations volte:
+# compila il modulo, genera, apre l'archivio, cerca il proprio cliente, filtra per
+# commerciale e ristampa. Il primo utente, al primo giro, genera anche lo ZIP dei
+# risultati della ricerca: deve arrivare al pulsante di download senza eccezioni.
+# Finiti gli utenti, una sessione sola esporta l'archivio come al clic (il runtime
+# esegue l'esportazione differita): tutti i formati devono arrivare ai byte.
+# Il foglio e' finto (in memoria) con latenza ed errori di quota configurabili. Alla fine si svuota la coda e si confrontano gli ID mostrati
+# agli utenti con quelli arrivati sul foglio: ID duplicati e salvataggi persi.
+# Uso: python loadtest.py --users 8 --iterations 3 --latency-ms 150 --quota-rate 0.05
+
+ACTIONS = ("avvio", "compila", "genera", "archivio", "cerca", "esporta", "zip", "filtra", "ristampa")
+CHECKS = ("esporta", "zip")  # azioni eseguite una volta sola: un errore fa fallire la prova
+SAVED = re.compile(r"Preventivo N\. (\d+) Salvato")
+
+# Script della sessione per AppTest. Il controllo su __name__ serve ai processi
+# "spawn" dello ZIP, che rieseguono lo script principale come __mp_main__.
+SESSION_SCRIPT = 'import app\nif __name__ == "__main__": app.main()\n'
+
+def share_test_runtime():
+    # AppTest installa un Runtime finto a ogni run e lo azzera alla fine: con piu'
+    # sessioni in parallelo una che finisce lo toglie a quelle ancora in corso.
+    # Qui resta valido l'ultimo creato (basta per i pulsanti di download).
+    from streamlit.runtime import Runtime
+    if getattr(Runtime, "_condiviso", False): return
+    last = [None]
+    def instance(cls):
+        current = cls._instance
+        if current is not None: last[0] = current
+        if last[0] is None: raise RuntimeError("Runtime hasn't been created!")
+        return last[0]
+    Runtime.instance = classmethod(instance)
+    Runtime.exists = classmethod(lambda cls: cls._instance is not None or last[0] is not None)
+    Runtime._condiviso = True
+    # la "magia" di Streamlit rianalizza lo script con ast a ogni run, e ast.parse
+    # da piu' thread insieme puo' fallire; l'app non la usa
+    from streamlit import config
+    config.set_option("runner.magicEnabled", False)
+
+def percentile(values, p):
+    return timing.percentile(sorted(values), p) if values else None
+
+class LoadStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.times = {a: [] for a in ACTIONS}
+        self.errors = {a: 0 for a in ACTIONS}
+        self.messages = []
+        self.saved = []        # (id, cliente, commerciale) mostrati come salvati
+        self.reprints = 0
+
+    def record(self, action, ms, error=None):
+        with self._lock:
+            self.times[action].append(ms)
+            if error:
+                self.errors[action] += 1
+                if len(self.messages) < 20: self.messages.append(f"{action}: {error}")
+
+    def add_saved(self, quote_id, cliente, user):
+        with self._lock: self.saved.append((quote_id, cliente, user))
+
+def _problems(at):
+    return [str(e.value) for e in at.exception] + [str(e.value) for e in at.error]
+
+def simulate_user(n, user, iterations, stats, timeout, seed):
+    from streamlit.testing.v1 import AppTest
+    rnd = random.Random(seed + n)
+    at = AppTest.from_string(SESSION_SCRIPT, default_timeout=timeout)
+    at.session_state["logged_in"] = True
+    at.session_state["user_name"] = user
+
+    def step(action, run, tab=app.TAB_GENERA, check=None):
+        at.session_state["k_scheda"] = tab  # AppTest non ricorda la scheda scelta
+        t0 = time.perf_counter()
+        try:
+            run()
+            error = "; ".join(_problems(at)) or (check() if check else None)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        stats.record(action, (time.perf_counter() - t0) * 1000, error)
+        return error is None
+
+    def button(label):
+        return next(b for b in at.button if label in b.label)
+
+    step("avvio", at.run)
+    for it in range(iterations):
+        cliente = f"Carico {n}-{it} Srl"
+        def fill():
+            if it: at.run()  # di nuovo sulla scheda Genera dopo l'archivio
+            at.text_input(key="k_cliente").input(cliente)
+            at.text_area(key="k_tipologia").input("Lavori edili")
+            at.number_input(key="k_prezzo1").set_value(float(rnd.choice([300, 450, 600, 900])))
+            at.run()
+        if not step("compila", fill): continue
+
+        def saved():
+            found = [SAVED.search(str(s.value)) for s in at.success]
+            found = [m for m in found if m]
+            if not found: return "nessuna conferma di salvataggio"
+            stats.add_saved(int(found[0].group(1)), cliente, user)
+        step("genera", lambda: button("Genera e Salva").click().run(), check=saved)
+
+        if not step("archivio", at.run, app.TAB_ARCHIVIO): continue
+        def search():
+            at.text_input(key="k_cerca").input(cliente)
+            at.selectbox(key="k_filtro_utente").select("Tutti")
+            at.run()
+        step("cerca", search, app.TAB_ARCHIVIO)
+        if n == 0 and it == 0:
+            def zipped():
+                if not any("Scarica ZIP" in d.label for d in at.get("download_button")): return "nessuno ZIP da scaricare"
+            step("zip", lambda: button("Genera ZIP").click().run(), app.TAB_ARCHIVIO, check=zipped)
+        def filter_user():
+            at.text_input(key="k_cerca").input("")
+            at.selectbox(key="k_filtro_utente").select(user)
+            at.run()
+        step("filtra", filter_user, app.TAB_ARCHIVIO)
+        def reprinted():
+            if not any("Scarica PDF" in d.label for d in at.get("download_button")): return "nessun PDF da scaricare"
+            with stats._lock: stats.reprints += 1
+        if any("RIGENERA" in b.label for b in at.button):
+            step("ristampa", lambda: button("RIGENERA").click().run(), app.TAB_ARCHIVIO, check=reprinted)
+
+def check_export(stats, timeout):
+    # A utenti fermi: le sessioni di AppTest condividono lo stesso id e un'altra
+    # esecuzione cancellerebbe le esportazioni differite registrate da questa
+    from streamlit.runtime import Runtime
+    from streamlit.testing.v1 import AppTest
+    at = AppTest.from_string(SESSION_SCRIPT, default_timeout=timeout)
+    at.session_state["logged_in"] = True
+    at.session_state["user_name"] = "ADMIN"
+    at.session_state["k_scheda"] = app.TAB_ARCHIVIO
+    t0 = time.perf_counter()
+    try:
+        at.run()
+        buttons = [d for d in at.get("download_button") if "Esporta" in d.proto.label]
+        for d in buttons:
+            Runtime.instance().media_file_mgr.execute_deferred(d.proto.deferred_file_id)
+        error = "; ".join(_problems(at)) or (None if buttons else "nessun pulsante di esportazione")
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    stats.record("esporta", (time.perf_counter() - t0) * 1000, error)
+
+def verify(sheet, stats, drain_timeout):
+    # Svuota la coda e confronta gli ID confermati agli utenti con il contenuto del foglio
+    queue = app.get_save_queue()
+    drained = queue.drain(drain_timeout)
+    with sheet._lock:
+        col = [r[0] if r else "" for r in sheet.rows]
+    on_sheet = set(v for v in col[1:] if v)
+    shown = [str(q[0]) for q in stats.saved]
+    missing = [q for q in shown if q not in on_sheet]
+    # ancora nel giornale locale: non perso, partira' al prossimo invio
+    queued = [q for q in missing if (queue.status(q) or {}).get("stato") in (STATO_IN_CODA, STATO_ERRORE)]
+    return {
+        "coda_svuotata": drained,
+        "in_coda": len(queued),
+        "id_duplicati_foglio": len(find_duplicate_ids(col)),
+        "id_duplicati_mostrati": len(shown) - len(set(shown)),
+        "salvataggi_persi": len(missing) - len(queued),
+    }
+
+def run_load_test(users, iterations, archive_rows, latency, quota_rate, seed=42, timeout=120, drain_timeout=120):
+    app.reset_resources()
+    app.DATA_DIR = tempfile.mkdtemp(prefix="preventivi_carico_")
+    timing.STORE.clear()
+    sheet = fake_archive(archive_rows, app.SHEET_COLUMNS, seed, latency=latency, quota_error_rate=quota_rate)
+    app.set_sheet_factory(lambda: sheet)
+    stats = LoadStats()
+    share_test_runtime()
+    names = [u for u in app.USERS_LIST if u != "ADMIN"]
+    threads = [threading.Thread(target=simulate_user, name=f"utente-{i}",
+                                args=(i, names[i % len(names)], iterations, stats, timeout, seed))
+               for i in range(users)]
+    t0 = time.perf_counter()
+    for t in threads: t.start()
+    for t in threads: t.join()
+    elapsed = time.perf_counter() - t0
+    check_export(stats, timeout)
+    checks = verify(sheet, stats, drain_timeout)
+    actions = []
+    for a in ACTIONS:
+        ms = stats.times[a]
+        actions.append({"azione": a, "n": len(ms), "errori": stats.errors[a],
+                        "p50_ms": round(percentile(ms, 50), 1) if ms else None,
+                        "p95_ms": round(percentile(ms, 95), 1) if ms else None,
+                        "max_ms": round(max(ms), 1) if ms else None})
+    total = sum(len(v) for a, v in stats.times.items() if a != "esporta")  # esporta: fuori dal tempo misurato
+    report = {
+        "meta": {"git": git_revision(), "python": platform.python_version(), "platform": platform.platform(),
+                 "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S")},
+        "config": {"utenti": users, "iterazioni": iterations, "righe_archivio": archive_rows,
+                   "latenza_ms": latency * 1000, "quota_rate": quota_rate, "seed": seed},
+        "durata_s": round(elapsed, 2),
+        "azioni_al_secondo": round(total / elapsed, 2) if elapsed else None,
+        "preventivi_al_minuto": round(len(stats.saved) / elapsed * 60, 1) if elapsed else None,
+        "preventivi_salvati": len(stats.saved),
+        "ristampe": stats.reprints,
+        "azioni": actions,
+        "verifica": checks,
+        "foglio": {"chiamate": sheet.calls, "errori_quota": sheet.quota_errors},
+        "contatori": timing.STORE.counters(),
+        "errori_esempio": stats.messages,
+    }
+    app.reset_resources()
+    return report
+
+def print_report(r, file=sys.stderr):
+    c = r["config"]
+    print(f"{c['utenti']} utenti x {c['iterazioni']} giri, archivio {c['righe_archivio']} righe, "
+          f"latenza {c['latenza_ms']:.0f} ms, 429 {c['quota_rate']:.0%}", file=file)
+    print(f"durata {r['durata_s']} s - {r['azioni_al_secondo']} azioni/s - {r['preventivi_al_minuto']} preventivi/min", file=file)
+    print(f"{'azione':<10}{'n':>5}{'errori':>8}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}", file=file)
+    for a in r["azioni"]:
+        fmt = lambda v: f"{v:>10.1f}" if v is not None else f"{'-':>10}"
+        print(f"{a['azione']:<10}{a['n']:>5}{a['errori']:>8}{fmt(a['p50_ms'])}{fmt(a['p95_ms'])}{fmt(a['max_ms'])}", file=file)
+    v = r["verifica"]
+    print(f"salvati {r['preventivi_salvati']} - ID duplicati sul foglio {v['id_duplicati_foglio']} - "
+          f"mostrati due volte {v['id_duplicati_mostrati']} - persi {v['salvataggi_persi']} - "
+          f"ancora in coda {v['in_coda']}", file=file)
+    for m in r["errori_esempio"]: print(f"  {m}", file=file)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prova di carico Presidia Preventivi (sessioni Streamlit simulate)")
+    parser.add_argument("--users", type=int, default=5, help="Commerciali simulati in parallelo")
+    parser.add_argument("--iterations", type=int, default=3, help="Giri genera/cerca/ristampa per utente")
+    parser.add_argument("--archive-rows", type=int, default=5000, help="Righe dell'archivio finto iniziale")
+    parser.add_argument("--latency-ms", type=float, default=100.0, help="Latenza di ogni chiamata al foglio")
+    parser.add_argument("--quota-rate", type=float, default=0.0, help="Probabilita' di un errore 429 per chiamata")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", help="File JSON con il risultato completo")
+    args = parser.parse_args(argv)
+
+    import logging
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    report = run_load_test(args.users, args.iterations, args.archive_rows, args.latency_ms / 1000,
+                           args.quota_rate, args.seed)
+    print_report(report)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f: f.write(json.dumps(report, indent=2, ensure_ascii=False) + "\n")
+    v = report["verifica"]
+    failed = any(a["errori"] or not a["n"] for a in report["azioni"] if a["azione"] in CHECKS)
+    return 1 if v["id_duplicati_foglio"] or v["id_duplicati_mostrati"] or v["salvataggi_persi"] or failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
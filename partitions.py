@@ -0,0 +1,171 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from search_index import normalize_text, SEARCH_FIELDS
+
+# --- ARCHIVIO DIVISO PER ANNO ---
+# Ogni anno ha il suo foglio nel file DB_Preventivi (Preventivi_2025, Preventivi_2026, ...).
+# L'app legge e scrive solo il foglio dell'anno in corso, che viene creato al primo
+# accesso del nuovo anno (rollover). Gli anni chiusi sono riassunti in un indice
+# SQLite locale (ID, anno, riga del foglio, data, commerciale, cliente e testo
+# normalizzato come in search_index): la ricerca storica non scarica i fogli, la
+# riga completa si legge solo al momento della ristampa.
+# Il vecchio sheet1 viene rinominato LEGACY_TITLE alla fine della migrazione
+# (cli.py partiziona): e' il segnale che l'archivio e' diviso.
+
+PARTITION_PREFIX = "Preventivi_"
+LEGACY_TITLE = "Archivio_non_partizionato"
+
+_TITLE = re.compile(r"Preventivi_(\d{4})")
+
+class PartitionError(RuntimeError):
+    pass
+
+def partition_title(anno):
+    return f"{PARTITION_PREFIX}{anno}"
+
+def partition_year(title):
+    m = _TITLE.fullmatch(str(title))
+    return int(m.group(1)) if m else None
+
+def is_partitioned(titles):
+    # titles: titoli dei fogli nell'ordine del file. Diviso se la migrazione e' conclusa
+    # (sheet1 rinominato) o se il vecchio foglio e' stato eliminato dopo
+    titles = list(titles)
+    return LEGACY_TITLE in titles or bool(titles and partition_year(titles[0]) is not None)
+
+def row_year(values, date_col=1):
+    data = str(values[date_col]).strip() if len(values) > date_col else ""
+    return int(data[:4]) if len(data) >= 4 and data[:4].isdigit() else None
+
+def trim_row(values):
+    values = [str(v) for v in values]
+    while values and values[-1] == "": values.pop()
+    return values
+
+def split_by_year(header, rows):
+    # {anno: righe} nell'ordine originale; le righe senza data restano con l'anno della precedente
+    date_col = header.index("Data") if "Data" in header else 1
+    parts = {}
+    anno = None
+    orphans = []
+    for values in rows:
+        year = row_year(values, date_col)
+        if year is not None: anno = year
+        if anno is None:
+            orphans.append(values)
+            continue
+        part = parts.setdefault(anno, [])
+        if orphans:
+            part.extend(orphans)
+            orphans = []
+        part.append(values)
+    if orphans: raise PartitionError(f"{len(orphans)} righe senza data: impossibile assegnarle a un anno")
+    return parts
+
+def _like(term):
+    return "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+class PartitionIndex:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        folder = os.path.dirname(db_path)
+        if folder: os.makedirs(folder, exist_ok=True)
+        with self._connect() as conn:
+            # partizioni: tutti gli anni con un foglio; indicizzata = 0 per l'anno in corso
+            # e per gli anni chiusi da (re)indicizzare
+            conn.execute("""CREATE TABLE IF NOT EXISTS partizioni (
+                anno INTEGER PRIMARY KEY,
+                indicizzata INTEGER NOT NULL DEFAULT 0,
+                righe INTEGER NOT NULL DEFAULT 0,
+                max_id INTEGER NOT NULL DEFAULT 0,
+                intestazione TEXT,
+                aggiornata REAL)""")
+            conn.execute("""CREATE TABLE IF NOT EXISTS righe (
+                anno INTEGER NOT NULL,
+                riga INTEGER NOT NULL,
+                preventivo_id TEXT NOT NULL,
+                data TEXT NOT NULL,
+                venditrice TEXT NOT NULL,
+                cliente TEXT NOT NULL,
+                testo TEXT NOT NULL,
+                PRIMARY KEY (anno, riga))""")
+            conn.execute("CREATE INDEX IF NOT EXISTS righe_id ON righe (preventivo_id)")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def years(self):
+        with self._connect() as conn:
+            return [r[0] for r in conn.execute("SELECT anno FROM partizioni ORDER BY anno")]
+
+    def indexed_years(self):
+        with self._connect() as conn:
+            return [r[0] for r in conn.execute("SELECT anno FROM partizioni WHERE indicizzata = 1 ORDER BY anno")]
+
+    def register(self, years):
+        with self._connect() as conn:
+            conn.executemany("INSERT OR IGNORE INTO partizioni (anno) VALUES (?)", [(int(y),) for y in years])
+
+    def mark_stale(self, anno):
+        # Righe arrivate in un anno gia' indicizzato (salvataggi in coda a cavallo del rollover)
+        with self._connect() as conn:
+            conn.execute("UPDATE partizioni SET indicizzata = 0 WHERE anno = ?", (int(anno),))
+
+    def header(self, anno):
+        with self._connect() as conn:
+            row = conn.execute("SELECT intestazione FROM partizioni WHERE anno = ?", (int(anno),)).fetchone()
+        return json.loads(row[0]) if row and row[0] else []
+
+    def replace(self, anno, header, rows):
+        # Reindicizza un anno chiuso; rows = righe del foglio senza intestazione (riga 2, 3, ...)
+        col = {name: i for i, name in enumerate(header)}
+        def get(values, name):
+            i = col.get(name)
+            return str(values[i]) if i is not None and i < len(values) else ""
+        entries = []
+        max_id = 0
+        for num, values in enumerate(rows, start=2):
+            if not any(str(v).strip() for v in values): continue
+            pid = get(values, "ID_Preventivo").strip()
+            if pid.isdigit(): max_id = max(max_id, int(pid))
+            text = "\x1f".join(normalize_text(get(values, f)) for f in SEARCH_FIELDS)
+            entries.append((int(anno), num, pid, get(values, "Data"), get(values, "Venditrice"), get(values, "Cliente"), text))
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM righe WHERE anno = ?", (int(anno),))
+            conn.executemany("INSERT INTO righe (anno, riga, preventivo_id, data, venditrice, cliente, testo) "
+                             "VALUES (?, ?, ?, ?, ?, ?, ?)", entries)
+            conn.execute("""INSERT INTO partizioni (anno, indicizzata, righe, max_id, intestazione, aggiornata)
+                            VALUES (?, 1, ?, ?, ?, ?) ON CONFLICT (anno) DO UPDATE SET indicizzata = 1,
+                            righe = excluded.righe, max_id = excluded.max_id, intestazione = excluded.intestazione,
+                            aggiornata = excluded.aggiornata""",
+                         (int(anno), len(entries), max_id, json.dumps(header, ensure_ascii=False), time.time()))
+        return len(entries)
+
+    def max_id(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT COALESCE(MAX(max_id), 0) FROM partizioni").fetchone()[0]
+
+    def search(self, query, user_filter="Tutti", limit=200):
+        # Righe degli anni chiusi che contengono tutte le parole della query, dalle piu' recenti
+        terms = normalize_text(query).split()
+        where, params = [], []
+        for term in terms:
+            where.append("testo LIKE ? ESCAPE '\\'")
+            params.append(_like(term))
+        if user_filter != "Tutti":
+            where.append("venditrice = ?")
+            params.append(user_filter)
+        sql = "SELECT anno, riga, preventivo_id, data, venditrice, cliente FROM righe"
+        if where: sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY anno DESC, riga DESC LIMIT ?"
+        with self._connect() as conn:
+            rows = conn.execute(sql, params + [limit]).fetchall()
+        return [dict(zip(("anno", "riga", "preventivo_id", "data", "venditrice", "cliente"), r)) for r in rows]
@@ -0,0 +1,272 @@
+import os
+import threading
+import zlib
+from datetime import datetime, timedelta
+
+from fpdf import FPDF
+
+from brand import (COMPANY_NAME, COMPANY_ADDR, COMPANY_P_IVA, COMPANY_WEB, LOGO_PATH, COLOR_PRIMARY, COLOR_TEXT,
+                   COLOR_LIGHT_GRAY, COLOR_BONUS_BG, COLOR_OPTIONAL_BG, PREZZI_ANALISI, TESTO_BONUS)
+
+# --- 2. PDF GENERATOR ---
+# Modulo separato da app.py: fpdf viene importato solo alla prima generazione.
+def clean_text(text):
+    if not isinstance(text, str): return str(text)
+    replacements = {'\u2022': '-', '\u201c': '"', '\u201d': '"', '\u2018': "'", '\u2019': "'", '\u2013': '-', '\u20ac': 'Euro'}
+    for k, v in replacements.items(): text = text.replace(k, v)
+    return text.encode('latin-1', 'replace').decode('latin-1')
+
+# Il logo viene decodificato una sola volta per processo (la decodifica del PNG
+# con canale alfa era quasi tutto il tempo di rendering) e riusato da ogni documento.
+# In modalita' compatta i flussi del logo (colore e trasparenza) vengono anche
+# ricompressi al massimo livello, senza filtri PNG quando rende meno byte: il
+# lavoro si fa una volta per processo e ogni PDF ne incorpora una sola copia.
+_logo_lock = threading.Lock()
+_logo_cache = {}
+_CHANNELS = {'DeviceRGB': 3, 'DeviceGray': 1, 'DeviceCMYK': 4, 'Indexed': 1}
+
+def _unfilter(data, width, bpp):
+    # Righe grezze di un flusso con predittori PNG (un byte di filtro per riga)
+    stride = width * bpp
+    prev = bytearray(stride)
+    rows = []
+    for pos in range(0, len(data), stride + 1):
+        kind = data[pos]
+        row = bytearray(data[pos + 1:pos + 1 + stride])
+        if kind == 1:
+            for i in range(bpp, stride): row[i] = (row[i] + row[i - bpp]) & 255
+        elif kind == 2:
+            for i in range(stride): row[i] = (row[i] + prev[i]) & 255
+        elif kind == 3:
+            for i in range(stride): row[i] = (row[i] + ((row[i - bpp] if i >= bpp else 0) + prev[i]) // 2) & 255
+        elif kind == 4:
+            for i in range(stride):
+                a = row[i - bpp] if i >= bpp else 0
+                b, c = prev[i], (prev[i - bpp] if i >= bpp else 0)
+                pa, pb, pc = abs(b - c), abs(a - c), abs(a + b - 2 * c)
+                row[i] = (row[i] + (a if pa <= pb and pa <= pc else b if pb <= pc else c)) & 255
+        rows.append(row)
+        prev = row
+    return rows
+
+def _compact_stream(stream, width, bpp):
+    data = zlib.decompress(stream)
+    plain = b"".join(b"\x00" + bytes(r) for r in _unfilter(data, width, bpp))
+    return min((stream, zlib.compress(data, 9), zlib.compress(plain, 9)), key=len)
+
+def _compact_image(info):
+    if info is None or info.get('f') != 'FlateDecode' or 'dp' not in info or info['bpc'] != 8: return info
+    compact = dict(info, data=_compact_stream(info['data'], info['w'], _CHANNELS[info['cs']]))
+    if 'smask' in info: compact['smask'] = _compact_stream(info['smask'], info['w'], 1)
+    return compact
+
+def get_logo_info(compact=False):
+    key = "compact" if compact else "info"
+    if key in _logo_cache: return _logo_cache[key]
+    with _logo_lock:
+        if "info" not in _logo_cache:
+            _logo_cache["info"] = FPDF()._parsepng(LOGO_PATH) if os.path.exists(LOGO_PATH) else None
+        if compact and "compact" not in _logo_cache:
+            _logo_cache["compact"] = _compact_image(_logo_cache["info"])
+        return _logo_cache[key]
+
+class PDF(FPDF):
+    def __init__(self, compact=False):
+        super().__init__()
+        self.compact = compact
+
+    def header(self):
+        logo = get_logo_info(self.compact)
+        if logo is not None:
+            if LOGO_PATH not in self.images:
+                # copia: _putimages() cancella i dati dell'immagine dopo averli scritti
+                self.images[LOGO_PATH] = dict(logo, i=len(self.images) + 1)
+                if 'smask' in logo and self.pdf_version < '1.4': self.pdf_version = '1.4'
+            self.image(LOGO_PATH, 10, 8, 45)
+        self.set_font('Helvetica', 'B', 9)
+        self.set_text_color(*COLOR_TEXT)
+        self.set_xy(100, 8)
+        self.cell(100, 4, COMPANY_NAME, ln=True, align='R')
+        self.set_font('Helvetica', '', 8)
+        self.cell(0, 4, COMPANY_ADDR, ln=True, align='R')
+        self.cell(0, 4, COMPANY_P_IVA, ln=True, align='R')
+        self.set_text_color(*COLOR_PRIMARY)
+        self.cell(0, 4, COMPANY_WEB, ln=True, align='R')
+        self.set_xy(10, 32)
+        self.set_draw_color(*COLOR_PRIMARY)
+        self.set_line_width(0.8)
+        self.line(10, 32, 200, 32)
+    def footer(self):
+        self.set_y(-12)
+        self.set_font('Helvetica', 'I', 7)
+        self.set_text_color(150, 150, 150)
+        self.cell(0, 4, f'Presidia Group srl - {COMPANY_WEB} - Pagina {self.page_no()}', ln=True, align='C')
+
+def create_pdf(data, compact=False):
+    pdf = PDF(compact)
+    pdf.set_auto_page_break(auto=True, margin=10)
+    pdf.add_page()
+    pdf.set_y(36)
+    pdf.set_font('Helvetica', 'B', 9)
+    pdf.set_text_color(80, 80, 80)
+    commerciale = data.get('user_name', 'N.D.')
+    pdf.cell(0, 4, f"COMMERCIALE DI RIFERIMENTO: {clean_text(commerciale)}", ln=True)
+    pdf.set_y(44)
+    pdf.set_font('Helvetica', 'B', 13)
+    pdf.set_text_color(*COLOR_PRIMARY)
+    title = "PREVENTIVO SERVIZI DI\nABBONAMENTO INFO GARE ED ESITI"
+    y_start = pdf.get_y()
+    pdf.multi_cell(95, 6, title)
+    pdf.set_xy(110, y_start) 
+    pdf.set_fill_color(*COLOR_LIGHT_GRAY)
+    pdf.set_draw_color(220, 220, 220)
+    pdf.set_line_width(0.2)
+    pdf.rect(110, y_start, 90, 28, 'FD') 
+    pdf.set_xy(115, y_start + 3)
+    pdf.set_font('Helvetica', 'B', 10)
+    pdf.set_text_color(0, 0, 0)
+    pdf.cell(80, 5, clean_text(f"Spett.le {data['cliente']}"), ln=True)
+    pdf.set_font('Helvetica', '', 9)
+    pdf.set_x(115)
+    pdf.cell(80, 5, clean_text(f"Email: {data['email']}"), ln=True)
+    pdf.set_x(115)
+    anno = data.get('anno') or datetime.now().year  # ristampe: anno del preventivo
+    pdf.cell(80, 5, f"Preventivo N.: {anno}/{str(data['preventivo_id']).zfill(3)}", ln=True)
+    pdf.set_x(115)
+    pdf.cell(80, 5, f"Data: {datetime.now().strftime('%d/%m/%Y')}", ln=True)
+    pdf.set_y(y_start + 34)
+
+    def draw_box(title, z, t):
+        pdf.set_font('Helvetica', 'B', 10)
+        pdf.set_text_color(255, 255, 255)
+        pdf.set_fill_color(*COLOR_PRIMARY)
+        pdf.cell(190, 7, f"  {title}", 0, 1, 'L', True)
+        y = pdf.get_y()
+        pdf.set_text_color(*COLOR_TEXT)
+        pdf.set_fill_color(255, 255, 255)
+        pdf.set_y(y + 3)
+        pdf.set_x(15)
+        pdf.set_font('Helvetica', 'B', 9)
+        pdf.cell(45, 5, "COPERTURA GEOGRAFICA:", 0, 0)
+        pdf.set_font('Helvetica', '', 9)
+        pdf.multi_cell(130, 5, clean_text(z))
+        pdf.set_x(15)
+        pdf.set_font('Helvetica', 'B', 9)
+        pdf.cell(45, 5, "TIPOLOGIA GARE:", 0, 0)
+        pdf.set_font('Helvetica', '', 9)
+        pdf.multi_cell(130, 5, clean_text(t))
+        pdf.ln(2)
+        h = pdf.get_y() - y
+        pdf.set_draw_color(200, 200, 200)
+        pdf.rect(10, y, 190, h, 'D')
+        pdf.ln(4)
+
+    z_str = ", ".join(data['zone'])
+    draw_box("CARATTERISTICHE SERVIZIO INFO GARE", z_str, data['tipologia'])
+    st_es = "SI" if data['esiti'] == "Sì" else "NO"
+    draw_box(f"CARATTERISTICHE SERVIZIO INFO ESITI ({st_es})", z_str, data['tipologia'])
+    
+    pdf.ln(4)
+    pdf.set_font('Helvetica', 'B', 11)
+    pdf.set_text_color(*COLOR_PRIMARY)
+    pdf.cell(0, 8, 'PROPOSTA ECONOMICA', ln=True)
+    pdf.set_fill_color(*COLOR_PRIMARY)
+    pdf.set_text_color(255, 255, 255)
+    pdf.set_font('Helvetica', 'B', 9)
+    pdf.cell(95, 7, '  Tipologia Servizio', 0, 0, 'L', True)
+    pdf.cell(30, 7, 'Imponibile', 0, 0, 'R', True)
+    pdf.cell(25, 7, 'IVA (22%)', 0, 0, 'R', True)
+    pdf.cell(40, 7, 'Totale  ', 0, 1, 'R', True)
+    
+    def add_row(d, p):
+        iva = p * 0.22
+        tot = p + iva
+        pdf.set_text_color(0, 0, 0)
+        pdf.set_font('Helvetica', '', 9)
+        x = pdf.get_x()
+        y = pdf.get_y()
+        pdf.set_draw_color(230, 230, 230)
+        pdf.line(x, y+8, x+190, y+8)
+        pdf.cell(95, 8, "  " + clean_text(d), 0, 0, 'L')
+        pdf.cell(30, 8, f"E. {p:,.2f}", 0, 0, 'R')
+        pdf.cell(25, 8, f"E. {iva:,.2f}", 0, 0, 'R')
+        pdf.set_font('Helvetica', 'B', 9)
+        pdf.cell(40, 8, f"E. {tot:,.2f}  ", 0, 1, 'R')
+
+    add_row('Abbonamento Annuale (12 Mesi)', data['prezzo_1'])
+    if data['prezzo_2'] > 0: add_row('Abbonamento Biennale (24 Mesi)', data['prezzo_2'])
+    if data['analisibando_qty'] > 0: add_row(f"Pacchetto ANALISI BANDO PRO ({data['analisibando_qty']} Report)", PREZZI_ANALISI[data['analisibando_qty']])
+    
+    pdf.ln(8)
+    by = pdf.get_y()
+    pdf.set_fill_color(*COLOR_BONUS_BG)
+    pdf.set_draw_color(*COLOR_PRIMARY)
+    pdf.rect(10, by, 190, 20, 'FD')
+    pdf.set_xy(15, by + 4)
+    pdf.set_font('Helvetica', 'B', 9)
+    pdf.set_text_color(0, 0, 0)
+    pdf.cell(30, 4, "BONUS INCLUSO:", ln=False)
+    pdf.set_font('Helvetica', '', 9)
+    pdf.set_xy(45, by + 4)
+    pdf.multi_cell(150, 4, TESTO_BONUS)
+    pdf.set_y(by + 26)
+
+    pdf.set_font('Helvetica', 'B', 9)
+    pdf.cell(25, 6, "Pagamento:", ln=False)
+    pdf.set_font('Helvetica', '', 9)
+    pdf.cell(60, 6, clean_text(data['pagamento']), ln=False)
+    pdf.set_font('Helvetica', 'B', 9)
+    pdf.cell(30, 6, "Scadenza Rate:", ln=False)
+    pdf.set_font('Helvetica', '', 9)
+    pdf.cell(0, 6, clean_text(data['scadenza_rate']), ln=True)
+    
+    try:
+        scad = (datetime.now() + timedelta(days=int(data['validita']))).strftime('%d/%m/%Y')
+    except:
+        scad = (datetime.now() + timedelta(days=15)).strftime('%d/%m/%Y')
+        
+    pdf.set_font('Helvetica', 'I', 9)
+    pdf.set_text_color(100, 100, 100)
+    pdf.cell(0, 6, f"Offerta valida fino al: {scad}", ln=True)
+    
+    if data['note']:
+        pdf.ln(3)
+        pdf.set_font('Helvetica', 'B', 9)
+        pdf.set_text_color(*COLOR_PRIMARY)
+        pdf.cell(0, 5, 'NOTE:', ln=True)
+        pdf.set_font('Helvetica', '', 8)
+        pdf.set_text_color(0, 0, 0)
+        pdf.multi_cell(0, 4, clean_text(data['note']))
+
+    y_curr = pdf.get_y()
+    y_start_box = max(y_curr + 10, 238)
+    if y_curr > 230 and y_curr < 250: y_start_box = y_curr + 5
+    elif y_curr >= 250:
+         pdf.add_page()
+         y_start_box = 30
+    pdf.set_y(y_start_box)
+    pdf.set_fill_color(*COLOR_PRIMARY)
+    pdf.rect(10, y_start_box, 190, 7, 'F')
+    pdf.set_xy(10, y_start_box + 1.5)
+    pdf.set_font('Helvetica', 'B', 10)
+    pdf.set_text_color(255, 255, 255)
+    pdf.cell(190, 5, "SERVIZI OPZIONALI OFFERTI DA PRESIDIA GROUP", ln=True, align='C')
+    pdf.set_fill_color(*COLOR_OPTIONAL_BG)
+    pdf.set_draw_color(*COLOR_PRIMARY)
+    pdf.rect(10, y_start_box + 7, 190, 28, 'FD')
+    pdf.set_xy(15, y_start_box + 10)
+    pdf.set_font('Helvetica', '', 9)
+    pdf.set_text_color(*COLOR_TEXT)
+    pdf.cell(4, 6, "-", ln=False)
+    pdf.cell(85, 6, "Business Intelligence su Analisi Ribassi Storici", ln=True)
+    pdf.set_x(15)
+    pdf.cell(4, 6, "-", ln=False)
+    pdf.cell(85, 6, "Assistenza Legale di 1 Livello", ln=True)
+    pdf.set_xy(105, y_start_box + 10)
+    pdf.cell(4, 6, "-", ln=False)
+    pdf.multi_cell(85, 6, "Preparazione Documentale di Gara\n(Predisposizione e Caricamento sul Portale)")
+    pdf.set_xy(105, pdf.get_y() + 1)
+    pdf.cell(4, 6, "-", ln=False)
+    pdf.cell(85, 6, "Avvalimenti", ln=True)
+    
+    return pdf.output(dest='S').encode('latin-1', 'replace')
@@ -0,0 +1,89 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# --- ARCHIVIO PDF GENERATI ---
+# Il PDF prodotto alla generazione viene salvato su disco, con nome pari all'hash
+# dei dati di input (contenuti identici -> un solo file). Un indice SQLite lega
+# ID_Preventivo -> hash e registra l'ultimo accesso: oltre `max_bytes` si
+# eliminano i file usati meno di recente. La ristampa legge da qui i byte
+# originali e rigenera il PDF solo se non lo trova o se l'impronta dei dati
+# (calcolata dal chiamante sulla riga dell'archivio) non coincide piu' con quella
+# registrata alla generazione: riga modificata nel foglio dopo il salvataggio.
+
+def content_hash(data):
+    payload = json.dumps(data, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class PdfStore:
+    def __init__(self, folder, max_bytes):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS pdf (
+                preventivo_id TEXT PRIMARY KEY,
+                hash TEXT NOT NULL,
+                dimensione INTEGER NOT NULL,
+                ultimo_accesso REAL NOT NULL)""")
+            if "impronta" not in [c[1] for c in conn.execute("PRAGMA table_info(pdf)")]:
+                conn.execute("ALTER TABLE pdf ADD COLUMN impronta TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS pdf_hash ON pdf (hash)")
+            conn.execute("CREATE INDEX IF NOT EXISTS pdf_accesso ON pdf (ultimo_accesso)")
+
+    def _connect(self):
+        return sqlite3.connect(os.path.join(self.folder, "indice.db"), timeout=30)
+
+    def _path(self, digest):
+        return os.path.join(self.folder, digest[:2], f"{digest}.pdf")
+
+    def put(self, preventivo_id, data, pdf_bytes, fingerprint=None):
+        digest = content_hash(data)
+        path = self._path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f: f.write(pdf_bytes)
+            os.replace(tmp, path)
+        with self._lock, self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO pdf (preventivo_id, hash, dimensione, ultimo_accesso, impronta) "
+                         "VALUES (?, ?, ?, ?, ?)", (str(preventivo_id), digest, len(pdf_bytes), time.time(), fingerprint))
+            self._evict(conn)
+        return digest
+
+    def get(self, preventivo_id, fingerprint=None):
+        # Con fingerprint: None anche se il PDF e' stato generato da dati diversi (o senza impronta)
+        with self._connect() as conn:
+            row = conn.execute("SELECT hash, impronta FROM pdf WHERE preventivo_id = ?", (str(preventivo_id),)).fetchone()
+            if row is None: return None
+            if fingerprint is not None and row[1] != fingerprint: return None
+            try:
+                with open(self._path(row[0]), "rb") as f: pdf_bytes = f.read()
+            except FileNotFoundError:
+                conn.execute("DELETE FROM pdf WHERE preventivo_id = ?", (str(preventivo_id),))
+                return None
+            conn.execute("UPDATE pdf SET ultimo_accesso = ? WHERE preventivo_id = ?", (time.time(), str(preventivo_id)))
+        return pdf_bytes
+
+    def total_bytes(self):
+        # Dimensione su disco: i file condivisi da piu' ID si contano una volta
+        with self._connect() as conn:
+            return conn.execute("SELECT COALESCE(SUM(d), 0) FROM (SELECT MAX(dimensione) AS d FROM pdf GROUP BY hash)").fetchone()[0]
+
+    def _evict(self, conn):
+        total = conn.execute("SELECT COALESCE(SUM(d), 0) FROM (SELECT MAX(dimensione) AS d FROM pdf GROUP BY hash)").fetchone()[0]
+        if total <= self.max_bytes: return
+        # hash in ordine di ultimo accesso (il piu' recente tra gli ID che lo usano)
+        for digest, size in conn.execute("""SELECT hash, MAX(dimensione) FROM pdf GROUP BY hash
+                                            ORDER BY MAX(ultimo_accesso)""").fetchall():
+            if total <= self.max_bytes: break
+            conn.execute("DELETE FROM pdf WHERE hash = ?", (digest,))
+            try:
+                os.remove(self._path(digest))
+            except FileNotFoundError:
+                pass
+            total -= size
@@ -0,0 +1,180 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import timing
+
+# --- CODA DI SALVATAGGIO (write-behind) ---
+# Ogni preventivo viene prima scritto nel giornale locale (SQLite in modalita' WAL),
+# poi un thread in background lo invia al foglio a blocchi con append_rows.
+# La chiave di idempotenza e' l'ID_Preventivo (unico per costruzione): se un invio
+# fallisce senza sapere se le righe sono arrivate, prima del nuovo tentativo si
+# controlla la colonna A e si marcano come inviate le righe gia' presenti.
+# Con partition_of(riga) le righe vanno al foglio della loro partizione (l'anno):
+# ogni invio contiene righe di una sola partizione, sempre in ordine di salvataggio.
+# Le righe inviate restano nel giornale SYNCED_RETENTION secondi (stato mostrato
+# all'utente, pannello ADMIN), poi il thread le elimina.
+
+SYNCED_RETENTION = 7 * 86400
+PRUNE_INTERVAL = 3600
+
+STATO_IN_CODA = "in_coda"
+STATO_SINCRONIZZATO = "sincronizzato"
+STATO_ERRORE = "errore"
+
+class SaveQueue:
+    def __init__(self, db_path, run_on_sheet, batch_size=50, flush_interval=2.0,
+                 base_backoff=2.0, max_backoff=300.0, on_flushed=None, partition_of=None):
+        # run_on_sheet(fn) esegue fn(worksheet), oppure run_on_sheet(fn, partizione) se c'e' partition_of;
+        # on_flushed() viene chiamata dopo ogni invio riuscito
+        self.db_path = db_path
+        self.run_on_sheet = run_on_sheet
+        self.partition_of = partition_of
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.on_flushed = on_flushed
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._last_prune = 0.0
+        folder = os.path.dirname(db_path)
+        if folder: os.makedirs(folder, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""CREATE TABLE IF NOT EXISTS giornale (
+                chiave TEXT PRIMARY KEY,
+                riga TEXT NOT NULL,
+                stato TEXT NOT NULL,
+                tentativi INTEGER NOT NULL DEFAULT 0,
+                incerto INTEGER NOT NULL DEFAULT 0,
+                prossimo_tentativo REAL NOT NULL DEFAULT 0,
+                ultimo_errore TEXT,
+                creato REAL NOT NULL,
+                sincronizzato REAL)""")
+            conn.execute("CREATE INDEX IF NOT EXISTS giornale_stato ON giornale (stato)")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute("PRAGMA synchronous=FULL")
+        return conn
+
+    # --- lato interfaccia ---
+    def enqueue(self, key, row):
+        # Scrittura durevole: al ritorno la riga e' sul disco anche se il processo termina
+        with self._connect() as conn:
+            conn.execute("INSERT INTO giornale (chiave, riga, stato, creato) VALUES (?, ?, ?, ?)",
+                         (str(key), json.dumps(row, ensure_ascii=False), STATO_IN_CODA, time.time()))
+        self.start()
+        self._wake.set()
+
+    def status(self, key):
+        with self._connect() as conn:
+            row = conn.execute("SELECT stato, tentativi, ultimo_errore FROM giornale WHERE chiave = ?",
+                               (str(key),)).fetchone()
+        if row is None: return None
+        return {"stato": row[0], "tentativi": row[1], "errore": row[2]}
+
+    def recent(self, limit=10):
+        with self._connect() as conn:
+            rows = conn.execute("""SELECT chiave, riga, stato, tentativi, ultimo_errore, creato
+                                   FROM giornale ORDER BY rowid DESC LIMIT ?""", (limit,)).fetchall()
+        return [{"chiave": r[0], "riga": json.loads(r[1]), "stato": r[2], "tentativi": r[3],
+                 "errore": r[4], "creato": r[5]} for r in rows]
+
+    def pending_count(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM giornale WHERE stato != ?", (STATO_SINCRONIZZATO,)).fetchone()[0]
+
+    def prune(self):
+        # Elimina le righe gia' sul foglio da piu' di SYNCED_RETENTION secondi; restituisce quante
+        with self._connect() as conn:
+            deleted = conn.execute("DELETE FROM giornale WHERE stato = ? AND sincronizzato < ?",
+                                   (STATO_SINCRONIZZATO, time.time() - SYNCED_RETENTION)).rowcount
+        self._last_prune = time.time()
+        return deleted
+
+    # --- worker ---
+    def start(self):
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive(): return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="save-queue", daemon=True)
+            self._thread.start()
+
+    def drain(self, timeout):
+        # Attende che il thread abbia inviato tutte le righe in coda (rispettando le attese
+        # tra i tentativi); True se la coda si e' svuotata entro timeout secondi
+        deadline = time.time() + timeout
+        while self.pending_count():
+            if time.time() >= deadline: return False
+            self._wake.set()
+            time.sleep(0.1)
+        return True
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None: self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                sent = self.flush_once()
+                if time.time() - self._last_prune > PRUNE_INTERVAL: self.prune()
+            except Exception:
+                sent = 0
+            if sent: continue  # potrebbero esserci altre righe in coda
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+
+    def _due_batch(self):
+        # Le righe partono in ordine di salvataggio: se la piu' vecchia e' in attesa
+        # di un nuovo tentativo, aspettano anche le successive
+        with self._connect() as conn:
+            batch = conn.execute("""SELECT chiave, riga, tentativi, incerto, prossimo_tentativo FROM giornale
+                                    WHERE stato != ? ORDER BY rowid LIMIT ?""",
+                                 (STATO_SINCRONIZZATO, self.batch_size)).fetchall()
+        if not batch or batch[0][4] > time.time(): return []
+        return batch
+
+    def flush_once(self):
+        # Invia un blocco di righe in coda; restituisce il numero di righe sincronizzate
+        batch = self._due_batch()
+        if not batch: return 0
+        try:
+            run = self.run_on_sheet
+            if self.partition_of is not None:
+                partitions = [self.partition_of(json.loads(b[1])) for b in batch]
+                batch = batch[:next((i for i, p in enumerate(partitions) if p != partitions[0]), len(batch))]
+                run = lambda fn: self.run_on_sheet(fn, partitions[0])
+            keys = [b[0] for b in batch]
+            already = set()
+            if any(b[3] for b in batch):
+                existing = run(lambda sheet: sheet.col_values(1))
+                already = {str(v).strip() for v in existing[1:]} & set(keys)
+            to_send = [json.loads(b[1]) for b in batch if b[0] not in already]
+            if to_send:
+                # nessun nuovo tentativo automatico qui: un timeout non dice se le righe sono arrivate
+                with timing.span("coda.append_rows"):
+                    run(lambda sheet: sheet.append_rows(to_send))
+        except Exception as e:
+            timing.count("coda.tentativi_falliti")
+            with self._connect() as conn:
+                for key, _, attempts, _, _ in batch:
+                    delay = min(self.max_backoff, self.base_backoff * (2 ** attempts))
+                    conn.execute("""UPDATE giornale SET stato = ?, tentativi = tentativi + 1, incerto = 1,
+                                    prossimo_tentativo = ?, ultimo_errore = ? WHERE chiave = ?""",
+                                 (STATO_ERRORE, time.time() + delay, str(e)[:500], key))
+            return 0
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany("UPDATE giornale SET stato = ?, sincronizzato = ?, ultimo_errore = NULL WHERE chiave = ?",
+                             [(STATO_SINCRONIZZATO, now, k) for k in keys])
+        timing.count("coda.righe_inviate", len(keys))
+        if self.on_flushed: self.on_flushed()
+        return len(keys)
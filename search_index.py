@@ -0,0 +1,65 @@
+import threading
+import unicodedata
+
+# --- INDICE DI RICERCA ARCHIVIO ---
+# Indice invertito a trigrammi su Cliente, ID_Preventivo, Email e Tipologia.
+# Ogni riga e' identificata dalla sua posizione nell'archivio (0, 1, 2, ...):
+# le righe nuove vengono solo aggiunte in coda, quindi l'indice si aggiorna
+# in modo incrementale. La ricerca parte dalla lista di posizioni piu' corta
+# tra i trigrammi della query e verifica i candidati con un confronto di sottostringa.
+
+SEARCH_FIELDS = ("ID_Preventivo", "Cliente", "Email", "Tipologia")  # stesso ordine delle tuple di add()
+
+def normalize_text(text):
+    text = unicodedata.normalize("NFKD", str(text))
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(text.casefold().split())
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+def _id_key(value):
+    value = str(value).strip()
+    try:
+        return str(int(float(value)))
+    except ValueError:
+        return value
+
+class SearchIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.texts = []
+        self.postings = {}
+        self.by_id = {}
+
+    def __len__(self):
+        return len(self.texts)
+
+    def add(self, rows):
+        # rows: iterabile di tuple (id, cliente, email, tipologia) nell'ordine dell'archivio
+        with self._lock:
+            for values in rows:
+                pos = len(self.texts)
+                text = "\x1f".join(normalize_text(v) for v in values)
+                self.texts.append(text)
+                for tri in _trigrams(text):
+                    self.postings.setdefault(tri, []).append(pos)
+                self.by_id.setdefault(_id_key(values[0]), pos)
+
+    def search(self, query):
+        # Posizioni (in ordine) delle righe che contengono tutte le parole della query
+        terms = normalize_text(query).split()
+        if not terms: return list(range(len(self.texts)))
+        with self._lock:
+            texts = self.texts
+            candidates = None
+            for term in terms:
+                for tri in _trigrams(term):
+                    posting = self.postings.get(tri)
+                    if posting is None: return []
+                    if candidates is None or len(posting) < len(candidates): candidates = posting
+            if candidates is None: candidates = range(len(texts))  # parole < 3 caratteri
+            return [p for p in candidates if all(t in texts[p] for t in terms)]
+
+    def lookup_id(self, preventivo_id):
+        return self.by_id.get(_id_key(preventivo_id))
@@ -0,0 +1,98 @@
+import random
+import threading
+import time
+
+import timing
+
+# --- ACCESSO A GOOGLE SHEETS CON QUOTA ---
+# Tutte le chiamate al foglio di un processo (quindi di tutte le sessioni
+# Streamlit) passano di qui:
+#   - token bucket: al massimo `per_minute` richieste al minuto, con raffiche
+#     fino a `burst`; oltre si aspetta il proprio turno (fino a max_wait secondi).
+#     Il gettone si prende per ogni richiesta HTTP (metered() avvolge il request del
+#     client), quindi una sincronizzazione che legge revisione e righe ne usa due;
+#   - errori di quota (429) e del server (5xx): nuovi tentativi con attesa
+#     esponenziale e jitter ("full jitter": casuale tra 0 e il limite del giro).
+# Le scritture (retry=False) ripetono solo dopo un 429, che garantisce che la
+# richiesta non e' stata eseguita.
+
+ERRORE_QUOTA = "quota"
+ERRORE_SERVER = "server"
+ERRORE_CONNESSIONE = "connessione"
+
+class QuotaWaitTimeout(RuntimeError):
+    pass
+
+class TokenBucket:
+    def __init__(self, per_minute, burst, clock=time.monotonic):
+        if per_minute <= 0 or burst < 1: raise ValueError("per_minute > 0 e burst >= 1")
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self.clock = clock
+        self._tokens = float(burst)
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        # Prende un gettone (anche a credito) e restituisce quanti secondi attendere prima di usarlo
+        with self._lock:
+            now = self.clock()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def cancel(self):
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + 1)
+
+class SheetsGate:
+    def __init__(self, classify, per_minute=60, burst=10, max_wait=10.0, max_attempts=3,
+                 base_backoff=1.0, max_backoff=16.0, sleep=time.sleep):
+        # classify(e) -> ERRORE_QUOTA / ERRORE_SERVER / ERRORE_CONNESSIONE oppure None (non ripetibile)
+        self.classify = classify
+        self.bucket = TokenBucket(per_minute, burst)
+        self.max_wait = max_wait
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.sleep = sleep
+
+    def acquire(self):
+        wait = self.bucket.reserve()
+        if wait > self.max_wait:
+            self.bucket.cancel()
+            timing.count("sheets.quota_locale_esaurita")
+            raise QuotaWaitTimeout(f"Limite di chiamate a Google Sheets raggiunto: riprovare tra {wait:.0f} s")
+        if wait > 0:
+            timing.count("sheets.attese_limite")
+            self.sleep(wait)
+
+    def metered(self, request):
+        # request del client (gspread.HTTPClient.request) che prende un gettone a ogni chiamata;
+        # avvolge sempre la funzione originale, anche se era gia' avvolta da un gate precedente
+        request = getattr(request, "_originale", request)
+        def call(*args, **kwargs):
+            self.acquire()
+            timing.count("sheets.chiamate")
+            return request(*args, **kwargs)
+        call._originale = request
+        return call
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.max_backoff, self.base_backoff * (2 ** attempt)))
+
+    def run(self, call, retry=True):
+        # call() fa le sue richieste attraverso un client avvolto con metered()
+        attempt = 0
+        while True:
+            try:
+                return call()
+            except Exception as e:
+                kind = self.classify(e)
+                if kind == ERRORE_QUOTA: timing.count("sheets.quota")
+                attempt += 1
+                if kind is None or attempt >= self.max_attempts: raise
+                if not retry and kind != ERRORE_QUOTA: raise
+                timing.count("sheets.ripetizioni")
+                if kind != ERRORE_CONNESSIONE: self.sleep(self.backoff(attempt - 1))
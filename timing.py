@@ -0,0 +1,87 @@
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# --- TEMPI DI RISPOSTA ---
+# Ogni fase (autenticazione, numerazione, PDF, salvataggio, caricamento archivio...)
+# viene misurata con `with span("fase"):`. Le ultime misure restano in memoria
+# per il pannello ADMIN; se PREVENTIVI_TIMING_LOG e' impostata vengono anche
+# scritte, una per riga in JSON, nel file indicato.
+
+MAX_SAMPLES = 2000
+
+class TimingStore:
+    def __init__(self, max_samples=MAX_SAMPLES, log_path=None):
+        self.max_samples = max_samples
+        self.log_path = log_path
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._errors = {}
+        self._counters = {}
+
+    def record(self, phase, ms, ok=True):
+        with self._lock:
+            self._samples.setdefault(phase, deque(maxlen=self.max_samples)).append(ms)
+            if not ok: self._errors[phase] = self._errors.get(phase, 0) + 1
+        if self.log_path:
+            line = json.dumps({"ts": round(time.time(), 3), "fase": phase, "ms": round(ms, 3), "ok": ok})
+            try:
+                with open(self.log_path, "a", encoding="utf-8") as f: f.write(line + "\n")
+            except OSError:
+                pass
+
+    def count(self, name, n=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def counters(self):
+        with self._lock:
+            return dict(self._counters)
+
+    def summary(self):
+        # Una riga per fase: chiamate, errori, p50/p95/p99 e massimo in ms (sulle ultime misure)
+        with self._lock:
+            snapshot = {k: sorted(v) for k, v in self._samples.items()}
+            errors = dict(self._errors)
+        rows = []
+        for phase, values in sorted(snapshot.items()):
+            rows.append({
+                "fase": phase,
+                "chiamate": len(values),
+                "errori": errors.get(phase, 0),
+                "p50_ms": round(percentile(values, 50), 1),
+                "p95_ms": round(percentile(values, 95), 1),
+                "p99_ms": round(percentile(values, 99), 1),
+                "max_ms": round(values[-1], 1),
+            })
+        return rows
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
+            self._errors.clear()
+            self._counters.clear()
+
+def percentile(sorted_values, pct):
+    if not sorted_values: return 0.0
+    k = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+STORE = TimingStore(log_path=os.environ.get("PREVENTIVI_TIMING_LOG") or None)
+
+@contextmanager
+def span(phase):
+    t0 = time.perf_counter()
+    ok = False
+    try:
+        yield
+        ok = True
+    finally:
+        STORE.record(phase, (time.perf_counter() - t0) * 1000, ok)
+
+def count(name, n=1):
+    STORE.count(name, n)